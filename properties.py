@@ -123,12 +123,12 @@ teleTiles = ['TELEINEVIL', 'TELEIN', 'TELECHECKIN', 'TELEINWEAPON', 'TELEINHOOK'
 
 def add(result, tiles, layer):
   if layer:
-    for tile in layer.tiles:
-      for key in tiles:
-        if tile.index == Tiles.get(key):
-          result[key] = True
-        if tile.index - 191 == Entities.get(key):
-          result[key] = True
+    counts = layer.count_by_index()
+    for key in tiles:
+      if key in Tiles and counts[Tiles[key]]:
+        result[key] = True
+      if key in Entities and counts[Entities[key] + 191]:
+        result[key] = True
 
 def main(argv):
   map_path = argv[1]
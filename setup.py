@@ -33,6 +33,12 @@ setup(
     packages = find_packages(),
     include_package_data = True,
     install_requires=read_file('requirements.txt'),
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': ['tml-batch = tml.batch:main'],
+    },
     classifiers = [
         'License :: OSI Approved :: GNU General Public License (GPL)',
     ],
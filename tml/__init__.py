@@ -25,3 +25,11 @@ def get_version():
 	return ''.join(vers)
 
 __version__ = get_version()
+
+def probe(map_path):
+	"""
+	Return the metadata of a map without loading it, see
+	:func:`tml.datafile.probe`
+	"""
+	from .datafile import probe
+	return probe(map_path)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Runs a function over a whole corpus of maps, spread across a pool of
+    processes. Can be used as a library or from the command line:
+
+        python -m tml.batch maps/ --func mymodule:check --workers 8
+
+    Every map is reported as one JSON line, in the order they complete.
+
+    :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import glob
+import importlib
+from itertools import islice
+import json
+import os
+import sys
+import time
+import traceback
+
+from .tml import Teemap, MapError
+
+
+def summary(teemap):
+    """Default per-map function, returns some basic information."""
+    return {
+        'width': teemap.width,
+        'height': teemap.height,
+        'groups': len(teemap.groups),
+        'layers': len(teemap.layers),
+        'images': len(teemap.images),
+    }
+
+
+def find_maps(paths):
+    """Expands directories (recursively) and glob patterns to map paths."""
+    map_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                map_paths.extend(os.path.join(root, name)
+                                 for name in sorted(files)
+                                 if name.endswith('.map'))
+        elif os.path.exists(path):
+            map_paths.append(path)
+        else:
+            map_paths.extend(sorted(glob.glob(path)))
+    return map_paths
+
+
+def import_func(name):
+    """Imports a function given as ``module:function``."""
+    module, _, func = name.partition(':')
+    if not func:
+        raise ValueError('Function must be given as module:function')
+    return getattr(importlib.import_module(module), func)
+
+
+def process_map(func, map_path, **kwargs):
+    """Loads one map and runs `func` on it.
+
+    Errors are caught and reported in the result, so one broken map does
+    not abort the whole scan.
+    """
+    start = time.time()
+    result = {'map': map_path}
+    try:
+        result['result'] = func(Teemap(map_path, **kwargs))
+    # MapError is not an Exception, it derives from BaseException
+    except (MapError, Exception) as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    result['time'] = time.time() - start
+    return result
+
+
+def scan(paths, func=summary, workers=None, **kwargs):
+    """Runs `func` on every map found in `paths` and yields the results as
+    they complete.
+
+    At most twice as many maps as there are workers are queued at a time,
+    more are submitted as results come in.
+
+    :param paths: Directories, map paths or glob patterns.
+    :param func: Callable taking a :class:`Teemap <tml.tml.Teemap>`. Must be
+                 importable by the worker processes, e.g. not a lambda.
+    :param workers: Number of processes, defaults to the number of CPUs.
+    :param kwargs: Passed to :class:`Teemap <tml.tml.Teemap>`, e.g. ``lazy``.
+
+    """
+    map_paths = iter(find_maps(paths))
+    ahead = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        while True:
+            for map_path in islice(map_paths, ahead - len(futures)):
+                futures[executor.submit(process_map, func, map_path,
+                                        **kwargs)] = map_path
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                map_path = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # the result could not be sent back or the worker died
+                    result = {'map': map_path,
+                              'error': '{0}: {1}'.format(type(e).__name__, e)}
+                yield result
+
+
+def _json_default(obj):
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', 'replace')
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return repr(obj)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a function over many '
+                                     'teeworlds maps in parallel.')
+    parser.add_argument('paths', nargs='+',
+                        help='directories, map files or glob patterns')
+    parser.add_argument('-f', '--func', default='tml.batch:summary',
+                        help='function to run, as module:function')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of processes (default: number of CPUs)')
+    parser.add_argument('--lazy', action='store_true',
+                        help='load the maps lazily')
+    parser.add_argument('--cache', action='store_true',
+                        help='use the on-disk cache of decompressed map data')
+    parser.add_argument('--traceback', action='store_true',
+                        help='include tracebacks of failed maps')
+    args = parser.parse_args(argv)
+
+    func = import_func(args.func)
+    start = time.time()
+    count = errors = 0
+    for result in scan(args.paths, func, args.workers, lazy=args.lazy,
+                         cache=args.cache or None):
+        count += 1
+        if 'error' in result:
+            errors += 1
+        if not args.traceback:
+            result.pop('traceback', None)
+        sys.stdout.write(json.dumps(result, default=_json_default))
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+    elapsed = time.time() - start
+    sys.stderr.write('Scanned {0} maps ({1} errors) in {2:.2f}s, {3:.1f} maps/s\n'.format(
+        count, errors, elapsed, count / elapsed if elapsed else 0))
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+    Caches of maps: :class:`DiskCache` keeps the decompressed data of maps
+    on disk, :class:`MapCache` keeps loaded maps in memory.
+
+    Loading a map spends most of its time inflating the tiles, quads and
+    images. The cache keeps the inflated data blobs of every map it has seen
+    in one file per map, keyed by a hash of the map file and the library
+    version, so a changed map or a new version of tml never hits a stale
+    entry. Pass it to :class:`Teemap <tml.tml.Teemap>`:
+
+        >>> teemap = Teemap('maps/dm1', cache=DiskCache())
+
+    Both caches are bounded in size, the least recently used entries are
+    removed first.
+
+    :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+from collections import OrderedDict
+import hashlib
+import mmap
+import os
+from struct import error as StructError, pack, unpack_from
+import tempfile
+import threading
+
+from . import __version__
+from .tml import Teemap
+
+MAGIC = b'TMLC'
+# blobs start at multiples of this, so they can be viewed as arrays
+ALIGNMENT = 8
+
+
+def default_cache_dir():
+    """Returns ``$XDG_CACHE_HOME/tml``, ``~/.cache/tml`` by default."""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'tml')
+
+
+class CacheEntry(object):
+    """The data blobs of one map, read from a memory mapping of the entry.
+
+    The file starts with the magic, the number of blobs and the start and
+    end offsets of the blobs, followed by the blobs themselves.
+
+    :raises: ValueError if the entry is damaged
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._mmap[:4] != MAGIC:
+                raise ValueError('Invalid cache entry')
+            count, = unpack_from('I', self._mmap, 4)
+            # start and end of every blob
+            self._offsets = unpack_from('{0}Q'.format(2 * count), self._mmap, 8)
+        except StructError:
+            self._mmap.close()
+            raise ValueError('Truncated cache entry')
+        except ValueError:
+            self._mmap.close()
+            raise
+        if self._offsets and max(self._offsets) > len(self._mmap):
+            self._mmap.close()
+            raise ValueError('Truncated cache entry')
+        self._view = memoryview(self._mmap)
+
+    def __len__(self):
+        return len(self._offsets) // 2
+
+    def __getitem__(self, index):
+        """Returns a blob as :class:`memoryview` of the mapping."""
+        return self._view[self._offsets[2*index]:self._offsets[2*index+1]]
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # blobs are still in use, the mapping is released with the last
+            # of them
+            pass
+
+    @staticmethod
+    def write(f, blobs):
+        """Writes the blobs to a file in the entry layout."""
+        offset = 8 + 16 * len(blobs)
+        offsets = []
+        for blob in blobs:
+            offset += -offset % ALIGNMENT
+            offsets.extend((offset, offset + len(blob)))
+            offset += len(blob)
+        f.write(MAGIC + pack('I', len(blobs)))
+        f.write(pack('{0}Q'.format(len(offsets)), *offsets))
+        for start, blob in zip(offsets[::2], blobs):
+            f.write(bytes(start - f.tell()))
+            f.write(blob)
+
+
+class DiskCache(object):
+    """Cache of inflated map data in a directory.
+
+    :param path: Directory of the cache, see :func:`default_cache_dir`.
+    :param max_size: Maximum size of all entries in bytes.
+    """
+
+    extension = '.tmlc'
+
+    def __init__(self, path=None, max_size=256 * 1024 * 1024):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+
+    def key(self, f):
+        """Returns the key of a map, given its file opened in binary mode or
+        its content."""
+        digest = hashlib.sha1(__version__.encode('ascii'))
+        if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+            digest.update(f)
+        else:
+            f.seek(0)
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + self.extension)
+
+    def get(self, key):
+        """Returns the :class:`CacheEntry` of a key or ``None``. Damaged
+        entries are removed."""
+        path = self._entry_path(key)
+        try:
+            entry = CacheEntry(path)
+        except (ValueError, StructError):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        except (IOError, OSError):
+            return None
+        # remember the use for the LRU eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, blobs):
+        """Stores the data blobs of a map and evicts old entries if the cache
+        got too big. Errors writing the cache are ignored."""
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    CacheEntry.write(f, blobs)
+                os.replace(tmp_path, self._entry_path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self.evict()
+        except (IOError, OSError):
+            pass
+
+    def entries(self):
+        """Returns ``(mtime, size, path)`` of all entries, oldest first."""
+        entries = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return entries
+        for name in names:
+            if name.endswith(self.extension):
+                path = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self, max_size=None):
+        """Removes the least recently used entries until the cache is not
+        bigger than `max_size`, defaults to :attr:`max_size`."""
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """Removes all entries."""
+        self.evict(0)
+
+
+def map_size(teemap):
+    """Returns the approximate memory used by the data of a map in bytes."""
+    size = 0
+    for layer in teemap.layers:
+        if layer.type == 'tilelayer':
+            for tiles in (layer.tiles, layer.tele_tiles, layer.speedup_tiles):
+                if tiles is not None:
+                    size += len(tiles) * tiles.tile_size
+        else:
+            size += len(layer.quads) * 152
+    for image in teemap.images:
+        # shared image data belongs to the pool, not to the map
+        if not image.external and not image.shared and image.data:
+            size += len(image.data)
+    return size
+
+
+class MapCache(object):
+    """Keeps loaded maps in memory and hands out copies of them.
+
+    Every map is loaded once, :meth:`get` returns a :meth:`copy
+    <tml.tml.Teemap.copy>` of it which shares the tile, quad and image data
+    with the cached map. Only the buffers a caller modifies are copied, the
+    cached map itself never changes. A map is loaded again when its file
+    changed.
+
+    :param max_size: Maximum size of the data of all cached maps in bytes,
+                     see :func:`map_size`. The least recently used maps are
+                     dropped first.
+    :param kwargs: Passed to :class:`Teemap <tml.tml.Teemap>`, e.g. ``cache``
+                   for a :class:`DiskCache`.
+    """
+
+    def __init__(self, max_size=512 * 1024 * 1024, **kwargs):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = self.misses = 0
+        self._kwargs = kwargs
+        # path -> (stamp, size, teemap), least recently used first
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _path(map_path):
+        if not os.path.splitext(map_path)[1]:
+            map_path = os.extsep.join([map_path, 'map'])
+        return os.path.abspath(map_path)
+
+    def get(self, map_path):
+        """Returns a copy of the map at `map_path`, loads it if it is not
+        cached or changed on disk."""
+        path = self._path(map_path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            cached = self._maps.pop(path, None)
+            if cached is not None:
+                self.size -= cached[1]
+                if cached[0] == stamp:
+                    self.hits += 1
+                    self._store(path, cached)
+                    return cached[2].copy()
+            self.misses += 1
+        teemap = Teemap(path, **self._kwargs)
+        cached = (stamp, map_size(teemap), teemap)
+        with self._lock:
+            old = self._maps.pop(path, None)
+            if old is not None:
+                self.size -= old[1]
+            if cached[1] <= self.max_size:
+                self._store(path, cached)
+        return teemap.copy()
+
+    def _store(self, path, cached):
+        self._maps[path] = cached
+        self.size += cached[1]
+        while self.size > self.max_size:
+            path, (stamp, size, teemap) = self._maps.popitem(last=False)
+            self.size -= size
+
+    def __contains__(self, map_path):
+        return self._path(map_path) in self._maps
+
+    def __len__(self):
+        return len(self._maps)
+
+    def clear(self):
+        """Drops all cached maps."""
+        with self._lock:
+            self._maps.clear()
+            self.size = 0
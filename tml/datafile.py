@@ -6,7 +6,10 @@
     :license: GNU GPL, see LICENSE for more details.
 """
 
-from struct import pack, unpack
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import mmap
+from struct import pack, unpack, unpack_from
 from zlib import compress, decompress
 
 from .constants import *
@@ -43,87 +46,74 @@ class Header(object):
             ])
 
 class DataFileReader(object):
+    """Reads a datafile and builds the items of the map.
+
+    :param map_path: Path to the map, with or without the ``.map`` extension.
+    :param lazy: Only parse the header, the item types and the offsets up
+                 front. Tiles and quads are read and decompressed the first
+                 time they are accessed.
+    :param use_mmap: Map the file into memory instead of reading it. Items
+                     are unpacked straight from the mapping and data blobs
+                     are handed out as :class:`memoryview` slices of it.
+    :param workers: Number of threads decompressing the tiles and quads
+                    before the items are built. Ignored in lazy mode.
+    :param cache: :class:`DiskCache <tml.cache.DiskCache>` to take the
+                  decompressed data from. On a miss all data is decompressed
+                  and stored in the cache, except in lazy mode.
+
+    The pixels of embedded images are decompressed on first access and
+    shared between all loaded maps with the same image, see
+    :class:`ImageData <tml.items.ImageData>`.
+    """
 
-    def __init__(self, map_path):
+    def __init__(self, map_path, lazy=False, use_mmap=False, workers=None,
+                 cache=None):
+        self.lazy = lazy
+        self._mmap = None
+        self._buffer = None
+        self._inflated = {}
+        self._cached = None
+        self._stamp = None
         # default list of item types
         for type_ in ITEM_TYPES:
             if type_ != 'version' and type_ != 'layer':
                 setattr(self, ''.join([type_, 's']), [])
 
-        path, filename = os.path.split(map_path)
-        self.name, extension = os.path.splitext(filename)
-        if extension == '':
-            self.map_path = os.extsep.join([map_path, 'map'])
-        elif extension != ''.join([os.extsep, 'map']):
-            raise TypeError('Invalid file')
-        else:
-            self.map_path = map_path
+        self._set_map_path(map_path)
+        try:
+            self._read(lazy, use_mmap, workers, cache)
+        except BaseException:
+            self.close()
+            raise
 
+    def _read(self, lazy, use_mmap, workers, cache):
         with open(self.map_path, 'rb') as f:
             self.f = f
-            self.header = Header(f)
-            self.item_types = []
-            for i in range(self.header.num_item_types):
-                val = unpack('3i', f.read(12))
-                self.item_types.append({
-                    'type': val[0],
-                    'start': val[1],
-                    'num': val[2],
-                })
-            fmt = '{0}i'.format(self.header.num_items)
-            self.item_offsets = unpack(fmt, f.read(self.header.num_items * 4))
-            fmt = '{0}i'.format(self.header.num_raw_data)
-            self.data_offsets = unpack(fmt, f.read(self.header.num_raw_data * 4))
-
-            # check version
-            item_size, version_item = self.find_item(f, ITEM_VERSION, 0)
-            fmt = '{0}i'.format(item_size//4)
-            version = unpack(fmt, version_item)[0] # we only expect 1 element here
-            if version != 1:
-                raise ValueError('Wrong version')
+            if lazy:
+                self._stamp = self._get_stamp(f)
+            if use_mmap:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._buffer = memoryview(self._mmap)
+            self._read_tables(f)
+
+            if cache is not None:
+                self._load_cache(f, cache, workers)
+            elif workers and workers > 1 and not lazy:
+                self._prefetch(f, workers)
 
             # load items
             # begin with map info
-            item = self.find_item(f, ITEM_INFO, 0)
-            if item is not None:
-                item_size, item_data = item
-                fmt = '{0}i'.format(item_size//4)
-                item_data = unpack(fmt, item_data)
-                version, author, map_version, credits, \
-                license = item_data[:items.Info.type_size]
-                if author > -1:
-                    author = decompress(self.get_compressed_data(f, author))[:-1]
-                else:
-                    author = None
-                if map_version > -1:
-                    map_version = decompress(self.get_compressed_data(f, map_version))[:-1]
-                else:
-                    map_version = None
-                if credits > -1:
-                    credits = decompress(self.get_compressed_data(f, credits))[:-1]
-                else:
-                    credits = None
-                if license > -1:
-                    license = decompress(self.get_compressed_data(f, license))[:-1]
-                else:
-                    license = None
-                self.info = items.Info(author=author, map_version=map_version,
-                                       credits=credits, license=license)
-            else:
-                self.info = None
+            self.info = self._read_info(f)
 
             # load images
             start, num = self.get_item_type(ITEM_IMAGE)
             for i in range(num):
-                item = self.get_item(f, start+i)
-                item_size, item_data = item
-                fmt = '{0}i'.format(item_size//4)
-                item_data = unpack(fmt, item_data)
+                item_data = self.get_item_data(f, start+i)
                 version, width, height, external, image_name, \
                 image_data = item_data[:items.Image.type_size]
                 external = bool(external)
                 name = decompress(self.get_compressed_data(f, image_name))[:-1]
-                data = decompress(self.get_compressed_data(f, image_data)) if not external else None
+                data = self._get_image_data(f, image_data) if not external else None
                 image = items.Image(external=external, name=name,
                                    data=data, width=width, height=height)
                 self.images.append(image)
@@ -131,9 +121,7 @@ class DataFileReader(object):
             # load groups
             group_item_start, group_item_num = self.get_item_type(ITEM_GROUP)
             for i in range(group_item_num):
-                item_size, item_data = self.get_item(f, group_item_start+i)
-                fmt = '{0}i'.format(item_size//4)
-                item_data = unpack(fmt, item_data)
+                item_data = self.get_item_data(f, group_item_start+i)
                 version, offset_x, offset_y, parallax_x, parallax_y, \
                 start_layer, num_layers, use_clipping, clip_x, clip_y, \
                 clip_w, clip_h = item_data[:items.Group.type_size-3]
@@ -148,9 +136,7 @@ class DataFileReader(object):
                 layer_item_start, layer_item_num = self.get_item_type(ITEM_LAYER)
                 layers = []
                 for j in range(num_layers):
-                    item_size, item_data = self.get_item(f, layer_item_start+start_layer+j)
-                    fmt = '{0}i'.format(item_size//4)
-                    item_data = unpack(fmt, item_data)
+                    item_data = self.get_item_data(f, layer_item_start+start_layer+j)
                     layer_version, type_, flags = item_data[:items.Layer.type_size]
                     detail = True if flags else False
 
@@ -164,62 +150,19 @@ class DataFileReader(object):
                         if version >= 3:
                             name = ints_to_string(item_data[type_size-3:type_size]) or None
 
-                        tile_list = []
-                        if game == 8: # Hack for front layer
-                          if version >= 3:
-                            tile_data = item_data[items.TileLayer.type_size+2]
-                          else:
-                            tile_data = item_data[items.TileLayer.type_size-1]
-                          tile_data = decompress(self.get_compressed_data(f, tile_data))
+                        tile_data, tele_data, speedup_data = \
+                            self._get_tile_data_indices(item_data)
+                        if version >= 4:
+                            # tiles are skip compressed since version 4
+                            tiles = items.TileManager(runs=self.get_data(f, tile_data))
                         else:
-                          tile_data = decompress(self.get_compressed_data(f, data))
-                        for i in range(0, len(tile_data), 4):
-                          tile_list.append(tile_data[i:i+4])
-
-                        tiles = items.TileManager(data=tile_list)
+                            tiles = items.TileManager(data=self.get_data(f, tile_data))
                         tele_tiles = None
                         speedup_tiles = None
-
-                        if game == 2:
-                            tele_list = []
-                            if version >= 3:
-                                # num of tele data is right after the default type length
-                                if len(item_data) > items.TileLayer.type_size: # some security
-                                    tele_data = item_data[items.TileLayer.type_size]
-                                    if tele_data > -1 and tele_data < self.header.num_raw_data:
-                                        tele_data = decompress(self.get_compressed_data(f, tele_data))
-                                        for i in range(0, len(tele_data), 2):
-                                            tele_list.append(tele_data[i:i+2])
-                                        tele_tiles = items.TileManager(data=tele_list, _type=1)
-                            else:
-                                # num of tele data is right after num of data for old maps
-                                if len(item_data) > items.TileLayer.type_size-3: # some security
-                                    tele_data = item_data[items.TileLayer.type_size-3]
-                                    if tele_data > -1 and tele_data < self.header.num_raw_data:
-                                        tele_data = decompress(self.get_compressed_data(f, tele_data))
-                                        for i in range(0, len(tele_data), 2):
-                                            tele_list.append(tele_data[i:i+2])
-                                        tele_tiles = items.TileManager(data=tele_list, _type=1)
-                        elif game == 4:
-                            speedup_list = []
-                            if version >= 3:
-                                # num of speedup data is right after tele data
-                                if len(item_data) > items.TileLayer.type_size+1: # some security
-                                    speedup_data = item_data[items.TileLayer.type_size+1]
-                                    if speedup_data > -1 and speedup_data < self.header.num_raw_data:
-                                        speedup_data = decompress(self.get_compressed_data(f, speedup_data))
-                                        for i in range(0, len(speedup_data), 4):
-                                            speedup_list.append(speedup_data[i:i+4])
-                                        speedup_tiles = items.TileManager(data=speedup_list, _type=2)
-                            else:
-                                # num of speedup data is right after tele data
-                                if len(item_data) > items.TileLayer.type_size-2: # some security
-                                    speedup_data = item_data[items.TileLayer.type_size-2]
-                                    if speedup_data > -1 and speedup_data < self.header.num_raw_data:
-                                        speedup_data = decompress(self.get_compressed_data(f, speedup_data))
-                                        for i in range(0, len(speedup_data), 4):
-                                            speedup_list.append(speedup_data[i:i+4])
-                                        speedup_tiles = items.TileManager(data=speedup_list, _type=2)
+                        if tele_data > -1 and tele_data < self.header.num_raw_data:
+                            tele_tiles = items.TileManager(data=self.get_data(f, tele_data), _type=1)
+                        if speedup_data > -1 and speedup_data < self.header.num_raw_data:
+                            speedup_tiles = items.TileManager(data=self.get_data(f, speedup_data), _type=2)
                         layer = items.TileLayer(width=width, height=height,
                                                 name=name, detail=detail, game=game,
                                                 color=tuple(color), color_env=color_env,
@@ -234,11 +177,7 @@ class DataFileReader(object):
                         name = None
                         if version >= 2:
                             name = ints_to_string(item_data[type_size-3:type_size]) or None
-                        quad_data = decompress(self.get_compressed_data(f, data))
-                        quad_list = []
-                        for k in range(0, len(quad_data), 152):
-                            quad_list.append(quad_data[k:k+152])
-                        quads = items.QuadManager(data=quad_list)
+                        quads = items.QuadManager(data=self.get_data(f, data, 152))
                         layer = items.QuadLayer(name=name, detail=detail,
                                                 image_id=image_id, quads=quads)
                         layers.append(layer)
@@ -252,9 +191,7 @@ class DataFileReader(object):
                 self.groups.append(group)
 
             # load envpoints
-            item_size, item = self.find_item(f, ITEM_ENVPOINT, 0)
-            fmt = '{0}i'.format(item_size//4)
-            item = unpack(fmt, item)
+            item = self.find_item_data(f, ITEM_ENVPOINT, 0)
             type_size = items.Envpoint.type_size
             for i in range(len(item)//6):
                 point = list(item[(i*6):(i*6+6)])
@@ -268,9 +205,7 @@ class DataFileReader(object):
             start, num = self.get_item_type(ITEM_ENVELOPE)
             type_size = items.Envelope.type_size
             for i in range(num):
-                item_size, item_data = self.get_item(f, start+i)
-                fmt = '{0}i'.format(item_size//4)
-                item_data = unpack(fmt, item_data)
+                item_data = self.get_item_data(f, start+i)
                 version, channels, start_point, \
                 num_point = item_data[:type_size-9]
                 name = ints_to_string(item_data[type_size-9:type_size-1])
@@ -282,6 +217,131 @@ class DataFileReader(object):
                                           synced=synced)
                 self.envelopes.append(envelope)
 
+            # everything is decompressed, the mapping is not needed anymore
+            if not self.lazy:
+                self.close()
+
+    def _get_tile_data_indices(self, item_data):
+        """Returns the data indices of the tiles, the tele tiles and the
+        speedup tiles of a tilelayer item. Missing ones are -1."""
+        type_size = items.TileLayer.type_size
+        version, game, data = item_data[3], item_data[6], item_data[14]
+        tele_data = speedup_data = -1
+        if game == 8: # Hack for front layer
+            if version >= 3:
+                data = item_data[type_size+2]
+            else:
+                data = item_data[type_size-1]
+        # num of tele data is right after the default type length, or right
+        # after num of data for old maps. speedup data follows tele data.
+        offset = type_size if version >= 3 else type_size-3
+        if game == 2 and len(item_data) > offset: # some security
+            tele_data = item_data[offset]
+        elif game == 4 and len(item_data) > offset+1:
+            speedup_data = item_data[offset+1]
+        return data, tele_data, speedup_data
+
+    def _get_image_data(self, f, index):
+        """Returns the pooled :class:`ImageData <tml.items.ImageData>` of an
+        embedded image, the pixels are decompressed on first access."""
+        data = None
+        if self._cached is not None:
+            data = lambda: bytes(self._cached[index])
+        return items.ImageData.pooled(self.get_compressed_data(f, index), data)
+
+    def _get_data_indices(self, f):
+        """Returns the indices of the tile and quad data. Embedded images are
+        decompressed on first access."""
+        indices = []
+        start, num = self.get_item_type(ITEM_LAYER)
+        for i in range(num):
+            item_data = self.get_item_data(f, start+i)
+            if item_data[1] == LAYERTYPE_TILES:
+                indices.extend(index for index in self._get_tile_data_indices(item_data)
+                               if index > -1 and index < self.header.num_raw_data)
+            elif item_data[1] == LAYERTYPE_QUADS:
+                indices.append(item_data[5])
+        return indices
+
+    def _prefetch(self, f, workers):
+        """Decompresses the tile and quad data on a thread pool."""
+        indices = self._get_data_indices(f)
+        compressed = [self.get_compressed_data(f, index) for index in indices]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            self._inflated = dict(zip(indices, executor.map(decompress, compressed)))
+
+    def _set_map_path(self, map_path):
+        path, filename = os.path.split(map_path)
+        self.name, extension = os.path.splitext(filename)
+        if extension == '':
+            self.map_path = os.extsep.join([map_path, 'map'])
+        elif extension != ''.join([os.extsep, 'map']):
+            raise TypeError('Invalid file')
+        else:
+            self.map_path = map_path
+
+    def _read_tables(self, f):
+        """Reads the header, the item types and the item and data offsets
+        and checks the version."""
+        self.header = Header(f)
+        self.item_types = []
+        for i in range(self.header.num_item_types):
+            val = unpack('3i', f.read(12))
+            self.item_types.append({
+                'type': val[0],
+                'start': val[1],
+                'num': val[2],
+            })
+        fmt = '{0}i'.format(self.header.num_items)
+        self.item_offsets = unpack(fmt, f.read(self.header.num_items * 4))
+        fmt = '{0}i'.format(self.header.num_raw_data)
+        self.data_offsets = unpack(fmt, f.read(self.header.num_raw_data * 4))
+
+        # check version
+        version = self.find_item_data(f, ITEM_VERSION, 0)[0] # we only expect 1 element here
+        if version != 1:
+            raise ValueError('Wrong version')
+
+    def _read_info(self, f):
+        """Returns the map :class:`Info <tml.items.Info>` or ``None``."""
+        item_data = self.find_item_data(f, ITEM_INFO, 0)
+        if item_data is None:
+            return None
+        strings = []
+        for index in item_data[1:items.Info.type_size]:
+            if index > -1:
+                strings.append(decompress(self.get_compressed_data(f, index))[:-1])
+            else:
+                strings.append(None)
+        author, map_version, credits, license = strings
+        return items.Info(author=author, map_version=map_version,
+                          credits=credits, license=license)
+
+    def _load_cache(self, f, cache, workers=None):
+        """Takes the decompressed data from the cache, or decompresses all
+        of it and stores it in the cache. In lazy mode a miss is not filled,
+        the data is decompressed on access as without a cache."""
+        key = cache.key(self._mmap if self._mmap is not None else f)
+        entry = cache.get(key)
+        if entry is not None and len(entry) != self.header.num_raw_data:
+            entry.close()
+            entry = None
+        if entry is None and self.lazy:
+            return
+        if entry is None:
+            compressed = [self.get_compressed_data(f, index)
+                          for index in range(self.header.num_raw_data)]
+            if workers and workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    blobs = list(executor.map(decompress, compressed))
+            else:
+                blobs = [decompress(data) for data in compressed]
+            cache.put(key, blobs)
+            entry = cache.get(key)
+            if entry is None:
+                entry = blobs
+        self._cached = entry
+
     def get_item_type(self, item_type):
         """Returns the index of the first item and the number of items for the type."""
         for i in range(self.header.num_item_types):
@@ -298,11 +358,24 @@ class DataFileReader(object):
     def get_item(self, f, index):
         """Returns the item from the file."""
         if index < self.header.num_items:
-            f.seek(self.header.size + self.item_offsets[index] + 8) # +8 to cut out type_and_id and size
+            offset = self.header.size + self.item_offsets[index] + 8 # +8 to cut out type_and_id and size
             size = self._get_item_size(index)
+            if self._buffer is not None:
+                return (size, self._buffer[offset:offset+size])
+            f.seek(offset)
             return (size, f.read(size))
         return None
 
+    def get_item_data(self, f, index):
+        """Returns the item from the file unpacked to a tuple of ints."""
+        if index < self.header.num_items:
+            fmt = '{0}i'.format(self._get_item_size(index)//4)
+            if self._buffer is not None:
+                offset = self.header.size + self.item_offsets[index] + 8
+                return unpack_from(fmt, self._buffer, offset)
+            return unpack(fmt, self.get_item(f, index)[1])
+        return None
+
     def find_item(self, f, item_type, index):
         """Finds the item and returns it from the file.
 
@@ -315,6 +388,49 @@ class DataFileReader(object):
             return self.get_item(f, start+index)
         return None
 
+    def find_item_data(self, f, item_type, index):
+        """Like :meth:`find_item`, but unpacks the item to a tuple of ints."""
+        start, num = self.get_item_type(item_type)
+        if num and index < num:
+            return self.get_item_data(f, start+index)
+        return None
+
+    def get_data(self, f, index, chunk_size=None):
+        """Returns the decompressed data, split into chunks of `chunk_size`.
+
+        In lazy mode a callable is returned instead, which reads and
+        decompresses the data when it gets called. It raises an IOError if
+        the file has changed since the map was loaded.
+        """
+        if self.lazy:
+            def load():
+                if self._buffer is not None:
+                    return self._decompress(None, index, chunk_size)
+                with open(self.map_path, 'rb') as f:
+                    # the offsets are only valid for the file read before
+                    if self._get_stamp(f) != self._stamp:
+                        raise IOError('{0} has changed since it was '
+                                      'loaded'.format(self.map_path))
+                    return self._decompress(f, index, chunk_size)
+            return load
+        return self._decompress(f, index, chunk_size)
+
+    def _get_stamp(self, f):
+        stat = os.fstat(f.fileno())
+        return (stat.st_mtime, stat.st_size)
+
+    def _decompress(self, f, index, chunk_size=None):
+        if self._cached is not None:
+            data = self._cached[index]
+        else:
+            data = self._inflated.pop(index, None)
+        if data is None:
+            data = decompress(self.get_compressed_data(f, index))
+        if chunk_size is None:
+            return data
+        return [bytes(data[i:i+chunk_size])
+                for i in range(0, len(data), chunk_size)]
+
     def _get_compressed_data_size(self, index):
         """Returns the size of the compressed data part."""
         if index == self.header.num_raw_data - 1:
@@ -324,10 +440,92 @@ class DataFileReader(object):
     def get_compressed_data(self, f, index):
         """Returns the compressed data and size of it from the file."""
         size = self._get_compressed_data_size(index)
-        f.seek(self.header.size + self.header.item_size + self.data_offsets[index])
+        offset = self.header.size + self.header.item_size + self.data_offsets[index]
+        if self._buffer is not None:
+            return self._buffer[offset:offset+size]
+        f.seek(offset)
         return f.read(size)
 
+    def close(self):
+        """Releases the memory mapping of the file and the cache entry, if
+        there are any."""
+        if hasattr(self._cached, 'close'):
+            self._cached.close()
+        self._cached = None
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # data is still in use, the mapping is released with it
+                pass
+            self._mmap = None
+
+# metadata of a map, see probe
+MapInfo = namedtuple('MapInfo', 'width height info images groups tile_layers '
+                                'quad_layers')
+
+
+class DataFileProbe(DataFileReader):
+    """Reads only the metadata of a datafile, see :func:`probe`.
+
+    Only the header, the item tables and a few items are read. The only
+    data decompressed are the map info strings and the image names.
+    """
+
+    def __init__(self, map_path):
+        self._buffer = None
+        self._set_map_path(map_path)
+        with open(self.map_path, 'rb') as f:
+            self._read_tables(f)
+            self.info = self._read_info(f)
+            self.images = []
+            start, num = self.get_item_type(ITEM_IMAGE)
+            for i in range(num):
+                image_name = self.get_item_data(f, start+i)[4]
+                self.images.append(decompress(self.get_compressed_data(f, image_name))[:-1])
+            self.width = self.height = None
+            self.tile_layers = self.quad_layers = 0
+            start, num = self.get_item_type(ITEM_LAYER)
+            for i in range(num):
+                item_data = self.get_item_data(f, start+i)
+                if item_data[1] == LAYERTYPE_TILES:
+                    self.tile_layers += 1
+                    # the first gamelayer, like Teemap.gamelayer
+                    if item_data[6] == 1 and self.width is None:
+                        self.width, self.height = item_data[4:6]
+                elif item_data[1] == LAYERTYPE_QUADS:
+                    self.quad_layers += 1
+            self.groups = self.get_item_type(ITEM_GROUP)[1]
+
+    def map_info(self):
+        return MapInfo(self.width, self.height, self.info, tuple(self.images),
+                       self.groups, self.tile_layers, self.quad_layers)
+
+
+def probe(map_path):
+    """Returns the metadata of a map without loading it, as :data:`MapInfo`
+    with the size of the gamelayer (``None`` without one), the map
+    :class:`Info <tml.items.Info>` (or ``None``), the image names and the
+    number of groups, tilelayers and quadlayers."""
+    return DataFileProbe(map_path).map_info()
+
+
 class DataFileWriter(object):
+    """Writes a teemap to a datafile.
+
+    :param teemap: The map to save.
+    :param map_path: Destination, with or without the ``.map`` extension.
+    :param workers: Number of threads compressing the data blobs. With
+                    ``None`` the blobs are compressed one after another.
+    :param compression_level: zlib compression level, ``-1`` is the zlib
+                              default.
+    :param skip_runs: Save the tiles skip compressed as layers of version 4,
+                      which older clients can't read. Maps with race layers
+                      are always saved with expanded tiles.
+    """
 
     class DataFileItem(object):
 
@@ -351,10 +549,15 @@ class DataFileWriter(object):
 
         def __init__(self, data):
             self.uncompressed_size = len(data)
-            self.data = compress(data)
+            self.data = data
+            self.compressed_size = None
+
+        def compress(self, level=-1):
+            self.data = compress(self.data, level)
             self.compressed_size = len(self.data)
 
-    def __init__(self, teemap, map_path):
+    def __init__(self, teemap, map_path, workers=None, compression_level=-1,
+                 skip_runs=False):
         path, filename = os.path.split(map_path)
         name, extension = os.path.splitext(filename)
         if extension == '':
@@ -391,6 +594,7 @@ class DataFileWriter(object):
                               image.external, image_name, image_data)))
         # save layers and groups
         layer_count = 0
+        race_layers = teemap.telelayer or teemap.speeduplayer
         for i, group in enumerate(teemap.groups):
             start_layer = layer_count
             for layer in group.layers:
@@ -398,32 +602,30 @@ class DataFileWriter(object):
                     tile_data = -1
                     tele_tile_data = -1
                     speedup_tile_data = -1
-                    tiles_str = b''
                     name = string_to_ints(layer.name or 'Tiles', 3)
+                    version = 3
                     if layer.is_telelayer:
                         tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(len(layer.tele_tiles.tiles)*b'\x00\x00\x00\x00'))
-                        for tile in layer.tele_tiles.tiles:
-                            tiles_str += tile
+                        datas.append(DataFileWriter.DataFileData(bytes(4*len(layer.tele_tiles))))
                         tele_tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(tiles_str))
+                        datas.append(DataFileWriter.DataFileData(layer.tele_tiles._buffer()))
                         name = string_to_ints('Tele', 3)
                     elif layer.is_speeduplayer:
                         tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(len(layer.speedup_tiles.tiles)*b'\x00\x00\x00\x00'))
-                        for tile in layer.speedup_tiles.tiles:
-                            tiles_str += tile
+                        datas.append(DataFileWriter.DataFileData(bytes(4*len(layer.speedup_tiles))))
                         speedup_tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(tiles_str))
+                        datas.append(DataFileWriter.DataFileData(layer.speedup_tiles._buffer()))
                         name = string_to_ints('Speedup', 3)
+                    elif skip_runs and not race_layers:
+                        version = 4
+                        tile_data = len(datas)
+                        datas.append(DataFileWriter.DataFileData(layer.tiles.compressed()))
                     else:
-                        for tile in layer.tiles.tiles:
-                            tiles_str += tile
                         tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(tiles_str))
-                        if layer.is_gamelayer:
-                            name = string_to_ints('Game', 3)
-                    if teemap.telelayer or teemap.speeduplayer:
+                        datas.append(DataFileWriter.DataFileData(layer.tiles._buffer()))
+                    if layer.is_gamelayer:
+                        name = string_to_ints('Game', 3)
+                    if race_layers:
                         items_.append(DataFileWriter.DataFileItem(ITEM_LAYER, layer_count,
                                pack('20i', 0, LAYERTYPE_TILES, layer.detail, 3, layer.width,
                                layer.height, layer.game, layer.color[0], layer.color[1],
@@ -432,22 +634,20 @@ class DataFileWriter(object):
                                name[1], name[2], tele_tile_data, speedup_tile_data)))
                     else:
                         items_.append(DataFileWriter.DataFileItem(ITEM_LAYER, layer_count,
-                               pack('18i', 0, LAYERTYPE_TILES, layer.detail, 3, layer.width,
+                               pack('18i', 0, LAYERTYPE_TILES, layer.detail, version, layer.width,
                                layer.height, layer.game, layer.color[0], layer.color[1],
                                layer.color[2], layer.color[3], layer.color_env,
                                layer.color_env_offset, layer.image_id, tile_data, *name)))
                     layer_count += 1
                 elif layer.type == 'quadlayer':
-                    if len(layer.quads.quads):
-                        quads_str = b''
-                        for quad in layer.quads.quads:
-                            quads_str += quad
+                    quads = layer.quads._list()
+                    if len(quads):
                         quad_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(quads_str))
+                        datas.append(DataFileWriter.DataFileData(b''.join(quads)))
                         name = string_to_ints(layer.name, 3)
                         items_.append(DataFileWriter.DataFileItem(ITEM_LAYER, layer_count,
                                pack('10i', 7, LAYERTYPE_QUADS, layer.detail, 2,
-                               len(layer.quads.quads), quad_data, layer.image_id, *name)))
+                               len(quads), quad_data, layer.image_id, *name)))
                         layer_count += 1
             name = string_to_ints('Game' if group.is_gamegroup else group.name, 3)
             items_.append(DataFileWriter.DataFileItem(ITEM_GROUP, i,
@@ -482,6 +682,15 @@ class DataFileWriter(object):
                pack(fmt, *envpoints)))
         items_.sort()
 
+        # compress data, zlib releases the GIL so threads run in parallel
+        if workers and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda data: data.compress(compression_level),
+                                  datas))
+        else:
+            for data in datas:
+                data.compress(compression_level)
+
         # calculate header
         item_size = 0
         num_item_types = 1
@@ -518,21 +727,19 @@ class DataFileWriter(object):
             fmt = '{0}i'.format(len(item_types))
             item_types_str = pack(fmt, *item_types)
             f.write(item_types_str)
-            item_offset_str = b''
-            offset = 0
-            for item in items_:
-                item_offset_str += pack('i', offset)
-                offset += item.size
-            f.write(item_offset_str)
-            data_offset_str = b''
-            offset = 0
-            for data in datas:
-                data_offset_str += pack('i', offset)
-                offset += data.compressed_size
-            f.write(data_offset_str)
-            for data in datas:
-                f.write(pack('i', data.uncompressed_size))
-            for item in items_:
-                f.write(item.data)
-            for data in datas:
-                f.write(data.data)
+            f.write(self._pack_offsets([item.size for item in items_]))
+            f.write(self._pack_offsets([data.compressed_size for data in datas]))
+            fmt = '{0}i'.format(len(datas))
+            f.write(pack(fmt, *[data.uncompressed_size for data in datas]))
+            f.write(b''.join([item.data for item in items_]))
+            f.writelines([data.data for data in datas])
+
+    @staticmethod
+    def _pack_offsets(sizes):
+        """Packs the offsets of consecutive parts with the given sizes."""
+        offsets = []
+        offset = 0
+        for size in sizes:
+            offsets.append(offset)
+            offset += size
+        return pack('{0}i'.format(len(offsets)), *offsets)
@@ -9,13 +9,23 @@
     :license: GNU GPL, see LICENSE for more details.
 """
 
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+import hashlib
+from itertools import groupby
 import os
 import shutil
-from struct import unpack, pack
+from struct import unpack, unpack_from, pack
 import warnings
+import weakref
 from zlib import decompress
 
 import png
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from .constants import ITEM_TYPES, TML_DIR, TILEFLAG_VFLIP, \
      TILEFLAG_HFLIP, TILEFLAG_OPAQUE, TILEFLAG_ROTATE
@@ -42,6 +52,84 @@ class Info(object):
     def __repr__(self):
         return '<MapInfo ({0})>'.format(self.author or 'None')
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# allowed bit depths, by PNG colour type
+PNG_BIT_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16),
+                  6: (8, 16)}
+
+# results of check_png by path, with the modification time and size of the
+# file they were checked at
+_png_checks = {}
+
+def check_png(path):
+    """Checks if a file looks like a PNG which can be read as RGBA.
+
+    Only the signature and the IHDR chunk are read, the image data is not
+    decoded. The results are remembered for the whole process, until the
+    file changes.
+
+    :raises: IOError if the file does not exist
+
+    """
+    stat = os.stat(path)
+    stamp = (stat.st_mtime, stat.st_size)
+    checked = _png_checks.get(path)
+    if checked is not None and checked[0] == stamp:
+        return checked[1]
+    with open(path, 'rb') as f:
+        header = f.read(29)
+    valid = False
+    if len(header) == 29 and header[:8] == PNG_SIGNATURE:
+        length, chunk_type, width, height, bit_depth, color_type = \
+            unpack('>I4sIIBB', header[8:26])
+        valid = chunk_type == b'IHDR' and length == 13 and width > 0 and \
+            height > 0 and bit_depth in PNG_BIT_DEPTHS.get(color_type, ())
+    _png_checks[path] = (stamp, valid)
+    return valid
+
+class ImageData(object):
+    """Pixel data of an embedded image, shared by all images with the same
+    compressed data.
+
+    Holds the compressed data until the pixels are needed first, then only
+    the decompressed pixels. Get instances through :meth:`pooled`.
+
+    :param compressed: zlib compressed pixel data
+    :param data: Decompressed pixel data, if it is already known
+    """
+
+    # pooled instances by the hash of the compressed data, they live as long
+    # as an image uses them
+    pool = weakref.WeakValueDictionary()
+
+    def __init__(self, compressed=None, data=None):
+        self._compressed = compressed
+        self._data = data
+
+    @classmethod
+    def pooled(cls, compressed, data=None):
+        """Returns the shared instance for the compressed data, creates one
+        if there is none yet.
+
+        :param data: Decompressed pixel data or a callable returning it, to
+                     spare the decompression of new instances.
+        """
+        key = hashlib.sha1(compressed).digest()
+        instance = cls.pool.get(key)
+        if instance is None:
+            if callable(data):
+                data = data()
+            instance = cls(None if data is not None else bytes(compressed), data)
+            cls.pool[key] = instance
+        return instance
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = decompress(self._compressed)
+            self._compressed = None
+        return self._data
+
 class Image(object):
     """Represents an image.
 
@@ -56,23 +144,27 @@ class Image(object):
     def __init__(self, name, width=0, height=0, external=False, data=None,
                  path=''):
         self.name = name
-        self.data = data
+        self._shared = None
+        if isinstance(data, ImageData):
+            self._shared = data
+            data = None
+        self._data = data
         self.width = width
         self.height = height
         self.external = external
         if external is True:
-            png_path = os.sep.join([TML_DIR, 'mapres', self.name.decode('utf-8')])
-            png_path = os.extsep.join([png_path, 'png'])
+            png_path = self.mapres_path
         else:
             png_path = path
 
-        if data is None:
+        if data is None and self._shared is None:
             try:
-                png.Reader(png_path).asRGBA()
-            except png.Error:
-                warnings.warn('Image is not in RGBA format')
+                valid = check_png(png_path)
             except IOError:
                 warnings.warn('External image "{0}" does not exist'.format(self.name))
+            else:
+                if not valid:
+                    warnings.warn('Image is not in RGBA format')
 
     def save(self, dest):
         """Saves the image to the given path.
@@ -83,22 +175,51 @@ class Image(object):
         if os.path.splitext(dest)[1] != ''.join([os.extsep, 'png']):
             dest = os.extsep.join([dest, 'png'])
         if self.external:
-            src = os.sep.join([TML_DIR, 'mapres', self.name.decode('utf-8')])
-            src = os.extsep.join([src, 'png'])
+            src = self.mapres_path
             if not os.path.exists(src):
                 raise ValueError('External image "{0}" does not exist'.format(self.name))
             shutil.copyfile(src, dest)
         else:
-            image = open(dest, 'wb')
-            png_writer = png.Writer(width=self.width, height=self.height, alpha=True)
-            fmt = '{0}B'.format(len(self.data))
-            image_data = unpack(fmt, self.data)
-            png_writer.write_array(image, image_data)
-            image.close()
+            png_writer = png.Writer(width=self.width, height=self.height,
+                                    greyscale=False, alpha=True)
+            with open(dest, 'wb') as image:
+                png_writer.write(image, self.rows())
+
+    @property
+    def mapres_path(self):
+        """Path of an external image in the mapres directory."""
+        path = os.sep.join([TML_DIR, 'mapres', self.name.decode('utf-8')])
+        return os.extsep.join([path, 'png'])
+
+    def rows(self):
+        """Returns the rows of an embedded image as :class:`memoryview`
+        slices of its data, without copying it."""
+        data = memoryview(self.data)
+        stride = self.width * 4
+        return [data[i:i+stride] for i in range(0, stride * self.height, stride)]
 
     def __repr__(self):
         return '<Image ({0})>'.format(self.name)
 
+    @property
+    def data(self):
+        """Raw RGBA data of an embedded image, shared ones are decompressed on
+        first access."""
+        if self._shared is not None:
+            return self._shared.data
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._shared = None
+        self._data = value
+
+    @property
+    def shared(self):
+        """Whether the pixel data is shared with other images, see
+        :class:`ImageData`."""
+        return self._shared is not None
+
     @property
     def resolution(self):
         return '{0} x {1}'.format(self.width, self.height)
@@ -214,6 +335,10 @@ class Layer(object):
     def is_speeduplayer(self):
         return False
 
+    @property
+    def is_frontlayer(self):
+        return False
+
 class TileLayer(Layer):
     """Represents a tilelayer.
 
@@ -243,13 +368,15 @@ class TileLayer(Layer):
         self.color_env = color_env
         self.color_env_offset = color_env_offset
         self.image_id = image_id
-        self.tiles = tiles or TileManager(width * height)
+        self.tiles = tiles if tiles is not None else TileManager(width * height)
         self.tele_tiles = None
         self.speedup_tiles = None
         if game == 2:
-            self.tele_tiles = tele_tiles or TileManager(width * height, _type=1)
+            self.tele_tiles = tele_tiles if tele_tiles is not None else \
+                TileManager(width * height, _type=1)
         if game == 4:
-            self.speedup_tiles = speedup_tiles or TileManager(width * height, _type=2)
+            self.speedup_tiles = speedup_tiles if speedup_tiles is not None else \
+                TileManager(width * height, _type=2)
         self.type = 'tilelayer'
 
     def _check_bounds(self, x, y):
@@ -279,6 +406,175 @@ class TileLayer(Layer):
         self._check_bounds(x, y)
         self.tiles[y*self.width+x] = tile
 
+    def _rect_rows(self, rect):
+        """Yields the start and end offset in the raw tile data of every row
+        of a ``(x, y, w, h)`` rectangle, cut to fit to the layer. ``None`` is
+        the whole layer."""
+        size = self.tiles.tile_size
+        if rect is None:
+            rect = (0, 0, self.width, self.height)
+        x, y, w, h = rect
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        if x0 == 0 and x1 == self.width:
+            yield y0 * self.width * size, y1 * self.width * size
+            return
+        for row in range(y0, y1):
+            start = (row * self.width + x0) * size
+            yield start, start + (x1 - x0) * size
+
+    def fill(self, rect, tile):
+        """Sets all tiles of a rectangle to a tile.
+
+        :param rect: ``(x, y, w, h)``, cut to fit to the layer, ``None`` for
+                     the whole layer.
+        :param tile: :class:`Tile`
+
+        """
+        string = self.tiles._tile_to_string(tile)
+        data = self.tiles.data
+        for start, end in self._rect_rows(rect):
+            data[start:end] = string * ((end - start) // len(string))
+        self._update_index()
+
+    def replace(self, old, new=None, rect=None):
+        """Replaces the index of tiles, keeping their flags.
+
+        >>> layer.replace(1, 3)
+        >>> layer.replace({1: 3, 3: 1}) # swaps the indices 1 and 3
+
+        :param old: Index to replace or a dict mapping old to new indices,
+                    all replaced in one pass.
+        :param new: New index, if `old` is an index.
+        :param rect: ``(x, y, w, h)`` to replace the tiles in, see :meth:`fill`
+        :returns: Number of replaced tiles
+
+        """
+        mapping = old if isinstance(old, dict) else {old: new}
+        table = bytes.maketrans(bytes(mapping.keys()), bytes(mapping.values()))
+        data = self.tiles.data
+        count = 0
+        for start, end in self._rect_rows(rect):
+            indices = data[start:end:4]
+            count += sum(indices.count(index) for index in mapping)
+            data[start:end:4] = indices.translate(table)
+        if count:
+            self._update_index()
+        return count
+
+    def build_index(self):
+        """Builds an index of the tiles, which makes :meth:`find` and
+        :meth:`count_by_index` cheap. See :meth:`TileManager.build_index`.
+
+        :returns: :class:`TileIndex`
+
+        """
+        return self.tiles.build_index()
+
+    def _update_index(self):
+        if self.tiles.index is not None:
+            self.tiles.build_index()
+
+    def _indices(self):
+        """Returns the index of every tile as bytes."""
+        return bytes(memoryview(self.tiles._buffer())[0::4])
+
+    def find(self, index):
+        """Returns the coordinates of all tiles with an index, row by row.
+
+        :returns: List of ``(x, y)`` tuples
+
+        """
+        if index and self.tiles.index is not None:
+            return [(position % self.width, position // self.width)
+                    for position in self.tiles.index.positions(index)]
+        indices = self._indices()
+        value = bytes((index,))
+        positions = []
+        position = indices.find(value)
+        while position != -1:
+            positions.append((position % self.width, position // self.width))
+            position = indices.find(value, position + 1)
+        return positions
+
+    def count_by_index(self):
+        """Counts the tiles of every index.
+
+        :returns: :class:`collections.Counter` mapping the indices to the
+                  number of tiles
+
+        """
+        if self.tiles.index is not None:
+            return Counter(dict((index, count) for index, count
+                                in enumerate(self.tiles.index.counts) if count))
+        return Counter(self._indices())
+
+    def apply_flags(self, rotate=None, hflip=False, vflip=False, rect=None):
+        """Flips and rotates every tile in place, like :meth:`Tile.hflip`,
+        :meth:`Tile.vflip` and :meth:`Tile.rotate` in that order. The tiles
+        themselves stay where they are.
+
+        :param rotate: Rotation direction, see :meth:`Tile.rotate`
+        :param rect: ``(x, y, w, h)`` to change the tiles in, see :meth:`fill`
+
+        """
+        # the new flags for every value of the flags byte
+        table = bytearray(256)
+        for flags in range(256):
+            tile = Tile(flags=flags)
+            if hflip:
+                tile.hflip()
+            if vflip:
+                tile.vflip()
+            if rotate is not None:
+                tile.rotate(rotate)
+            table[flags] = tile._flags
+        table = bytes(table)
+        data = self.tiles.data
+        for start, end in self._rect_rows(rect):
+            data[start+1:end:4] = data[start+1:end:4].translate(table)
+
+    def as_array(self):
+        """Returns the tiles as NumPy structured array of shape
+        ``(height, width)`` with the fields ``index``, ``flags``, ``skip``
+        and ``reserved``.
+
+        The array is a view on the raw tile data, changing it changes the
+        tiles of the layer. Requires NumPy.
+
+        """
+        return self.tiles.as_array((self.height, self.width))
+
+    def set_array(self, array):
+        """Replaces the tiles with the ones of a ``(height, width)`` array
+        like returned by :meth:`as_array`. The size of the layer is adapted to
+        the shape of the array.
+
+        :raises: ValueError
+
+        """
+        if len(array.shape) != 2:
+            raise ValueError('The array must be two-dimensional')
+        height, width = array.shape
+        if (width, height) != (self.width, self.height) and \
+           (self.tele_tiles is not None or self.speedup_tiles is not None):
+            raise ValueError('Resize the layer before setting an array of '
+                             'another size')
+        indexed = self.tiles.index is not None
+        self.tiles = TileManager(data=array.astype(TileManager.dtypes[0]).tobytes())
+        self._width = width
+        self._height = height
+        if indexed:
+            self.tiles.build_index()
+
+    def _managers(self):
+        """Yields the names of the tile managers of the layer."""
+        for name in ('tiles', 'tele_tiles', 'speedup_tiles'):
+            if getattr(self, name) is not None:
+                yield name
+
     def select(self, x, y, w=1, h=1):
         """Select an area of the tilelayer.
 
@@ -298,21 +594,9 @@ class TileLayer(Layer):
                           color_env=self.color_env,
                           color_env_offset=self.color_env_offset,
                           image_id=self.image_id)
-        data = []
-        for _y in range(h):
-            for _x in range(w):
-                data.append(self.tiles.tiles[(y+_y)*self.width+(x+_x)])
-        layer.tiles = TileManager(data=data)
-        if self.tele_tiles and len(self.tele_tiles.tiles) == len(self.tiles.tiles):
-            for _y in range(h):
-                for _x in range(w):
-                    data.append(self.tele_tiles.tiles[(y+_y)*self.width+(x+_x)])
-        layer.tele_tiles = TileManager(data=data)
-        if self.speedup_tiles and len(self.speedup_tiles.tiles) == len(self.tiles.tiles):
-            for _y in range(h):
-                for _x in range(w):
-                    data.append(self.speedup_tiles.tiles[(y+_y)*self.width+(x+_x)])
-        layer.speedup_tiles = TileManager(data=data)
+        for name in self._managers():
+            setattr(layer, name,
+                    getattr(self, name).select(self.width, x, y, w, h))
         return layer
 
     def draw(self, x, y, tilelayer):
@@ -325,14 +609,28 @@ class TileLayer(Layer):
 
         x = max(0, min(x, self.width-1))
         y = max(0, min(y, self.height-1))
-
-        for _y in range(tilelayer.height):
-            for _x in range(tilelayer.width):
-                tile = tilelayer.tiles[_y*tilelayer.width+_x]
-                try:
-                    self.tiles[(y+_y)*self.width+(x+_x)] = tile
-                except IndexError:
-                    pass
+        for name in self._managers():
+            tiles = getattr(tilelayer, name)
+            if tiles is not None:
+                getattr(self, name).draw(self.width, self.height, x, y, tiles,
+                                         tilelayer.width)
+        self._update_index()
+
+    def _resize(self, width, height):
+        if width < 0 or height < 0:
+            raise ValueError('Value must be positive')
+        if (width, height) == (self._width, self._height):
+            return
+        indexed = self.tiles.index is not None
+        for name in self._managers():
+            tiles = getattr(self, name)
+            resized = TileManager(width * height, _type=tiles.type)
+            resized.draw(width, height, 0, 0, tiles, self._width)
+            setattr(self, name, resized)
+        self._width = width
+        self._height = height
+        if indexed:
+            self.tiles.build_index()
 
     @property
     def width(self):
@@ -340,19 +638,7 @@ class TileLayer(Layer):
 
     @width.setter
     def width(self, value):
-        if value < 0:
-            raise ValueError('Value must be positive')
-        if value < self._width:
-            tiles = self.select(0, 0, value, self.height).tiles
-        elif value > self._width:
-            layer = TileLayer(value, self.height)
-            layer.draw(0, 0, self)
-            tiles = layer.tiles
-        else:
-            return
-
-        self._width = value
-        self.tiles = tiles
+        self._resize(value, self._height)
 
     @property
     def height(self):
@@ -360,19 +646,7 @@ class TileLayer(Layer):
 
     @height.setter
     def height(self, value):
-        if value < 0:
-            raise ValueError('Value must be positive')
-        if value < self._height:
-            tiles = self.select(0, 0, self.width, value).tiles
-        elif value > self._height:
-            layer = TileLayer(self.width, value)
-            layer.draw(0, 0, self)
-            tiles = layer.tiles
-        else:
-            return
-
-        self._height = value
-        self.tiles = tiles
+        self._resize(self._width, value)
 
     @property
     def is_gamelayer(self):
@@ -386,6 +660,10 @@ class TileLayer(Layer):
     def is_speeduplayer(self):
         return self.game == 4
 
+    @property
+    def is_frontlayer(self):
+        return self.game == 8
+
     def __repr__(self):
         if self.is_gamelayer:
             return '<Game layer ({0}x{1})>'.format(self.width, self.height)
@@ -413,7 +691,7 @@ class QuadLayer(Layer):
         super(QuadLayer, self).__init__(detail)
         self.name = name
         self.image_id = image_id
-        self.quads = quads or QuadManager()
+        self.quads = quads if quads is not None else QuadManager()
         self.type = 'quadlayer'
 
     def __repr__(self):
@@ -442,26 +720,62 @@ class QuadManager(object):
         workaround
 
     :param quads: List of quads to put in.
-    :param data: Raw quad data, used internally.
+    :param data: Raw quad data or a callable returning it, used internally.
     """
 
     def __init__(self, quads=None, data=None):
-        self.quads = []
+        self._loader = None
+        self._quads = []
+        self._shared = False
         if quads:
-            self.quads = [self._quad_to_string(quad) for quad in quads]
+            self._quads = [self._quad_to_string(quad) for quad in quads]
+        elif callable(data):
+            self._loader = data
         elif data:
-            self.quads.extend(data)
+            self._quads.extend(data)
+
+    def _list(self):
+        """Returns the list of quads without copying shared ones, must not
+        be modified."""
+        if self._loader is not None:
+            self._quads = list(self._loader())
+            self._loader = None
+        return self._quads
+
+    @property
+    def quads(self):
+        quads = self._list()
+        if self._shared:
+            self._quads = list(quads)
+            self._shared = False
+        return self._quads
+
+    @quads.setter
+    def quads(self, value):
+        self._loader = None
+        self._shared = False
+        self._quads = value
+
+    def copy(self):
+        """Returns a copy sharing the quads until one of them is modified."""
+        manager = QuadManager()
+        if self._loader is not None:
+            manager._loader = self._loader
+        else:
+            manager._quads = self._quads
+            manager._shared = self._shared = True
+        return manager
 
     def __getitem__(self, value):
         if isinstance(value, slice):
-            return QuadManager(self.quads[value])
-        return self._string_to_quad(self.quads[value])
+            return QuadManager(self._list()[value])
+        return self._string_to_quad(self._list()[value])
 
     def __setitem__(self, k, v):
         self.quads[k] = self._quad_to_string(v)
 
     def __len__(self):
-        return len(self.quads)
+        return len(self._list())
 
     def pop(self, value):
         return self._string_to_quad(self.quads.pop(value))
@@ -531,7 +845,8 @@ class Quad(object):
 class TileManager(object):
     """Handles tiles while sparing memory.
 
-    Keeps track of tiles as simple strings, but returns a Tile class on demand.
+    Keeps track of all tiles in one contiguous buffer of raw tile data, but
+    returns a Tile class on demand.
 
     .. note::
 
@@ -552,41 +867,314 @@ class TileManager(object):
 
     :param size: Fill up the manager with n empty tiles.
     :param tiles: List of tiles to put in.
-    :param data: Raw tile data, used internally.
+    :param data: Raw tile data or a callable returning it, used internally.
     :param _type: Used for a race modification, you probably don't need it
+    :param runs: Skip compressed tile data or a callable returning it, see
+                 :func:`expand_tile_runs`. The runs are kept as they are for
+                 reading single tiles and iterating, and are only expanded
+                 when the tiles are modified or the raw data is needed.
     """
 
-    def __init__(self, size=0, tiles=None, data=None, _type=0):
+    # structured NumPy dtypes of the raw tiles, by type
+    dtypes = {
+        0: [('index', 'u1'), ('flags', 'u1'), ('skip', 'u1'), ('reserved', 'u1')],
+        1: [('number', 'u1'), ('type', 'u1')],
+        2: {'names': ['force', 'angle'], 'formats': ['u1', '=i2'],
+            'offsets': [0, 2], 'itemsize': 4},
+    }
+
+    def __init__(self, size=0, tiles=None, data=None, _type=0, runs=None):
         self.type = _type
+        self.index = None
+        self._loader = None
+        self._data = None
+        self._runs = None
+        self._run_starts = None
+        self._shared = False
         if tiles is not None:
-            self.tiles = [self._tile_to_string(tile) for tile in tiles]
+            self.data = [self._tile_to_string(tile) for tile in tiles]
+        elif runs is not None:
+            self._runs = runs
+            self._loader = self._expand_runs
+        elif callable(data):
+            self._loader = data
         elif data is not None:
-            self.tiles = data
+            self.data = data
         else:
-            if _type == 1:
-                self.tiles = [b'\x00\x00'] * size
-            else:
-                self.tiles = [b'\x00\x00\x00\x00'] * size
+            self.data = bytearray(self.tile_size * size)
+
+    @property
+    def tile_size(self):
+        """Size of one tile in bytes."""
+        return 2 if self.type == 1 else 4
+
+    @property
+    def data(self):
+        """The raw tile data as one :class:`bytearray`."""
+        data = self._buffer()
+        if self._shared:
+            self._data = bytearray(data)
+            self._shared = False
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._loader = None
+        self._runs = self._run_starts = None
+        self._shared = False
+        if isinstance(value, (list, tuple)):
+            value = b''.join(value)
+        self._data = bytearray(value)
+        if self.index is not None:
+            self.build_index()
+
+    def _buffer(self):
+        """Returns the raw tile data without copying shared data, must not
+        be modified."""
+        if self._loader is not None:
+            self.data = self._loader()
+        return self._data
+
+    def copy(self):
+        """Returns a copy sharing the tile data until one of them is
+        modified."""
+        manager = TileManager(_type=self.type)
+        if self._loader is not None:
+            manager._loader = self._loader
+            if self._runs is not None:
+                manager._runs = self._runs
+                manager._run_starts = self._run_starts
+                manager._loader = manager._expand_runs
+        else:
+            manager._data = self._data
+            manager._shared = self._shared = True
+        if self.index is not None:
+            manager.index = self.index.copy()
+        return manager
+
+    def build_index(self):
+        """Builds a :class:`TileIndex` of the tiles and keeps it in
+        :attr:`index`. Only for normal tiles.
+
+        The index follows tiles set by item assignment and the bulk methods
+        of :class:`TileLayer`, build it again after changing :attr:`data` or
+        an array of the tiles directly.
+
+        :returns: TileIndex
+
+        """
+        self.index = TileIndex(self._buffer())
+        return self.index
+
+    def select(self, width, x, y, w, h):
+        """Returns a new manager with the tiles of a rectangle, copied row by
+        row. The rectangle must be within the layer.
+
+        :param width: Width of the layer of the tiles.
+        """
+        size = self.tile_size
+        src = memoryview(self._buffer())
+        if w == width:
+            data = bytearray(src[y*width*size:(y+h)*width*size])
+        else:
+            data = bytearray(w * h * size)
+            row = w * size
+            for i in range(h):
+                start = ((y+i)*width + x) * size
+                data[i*row:(i+1)*row] = src[start:start+row]
+        return TileManager(data=data, _type=self.type)
+
+    def draw(self, width, height, x, y, tiles, tiles_width):
+        """Copies the tiles of another manager to ``(x, y)`` row by row, the
+        part outside of the layer is discarded.
+
+        :param width: Width of the layer of the tiles.
+        :param height: Height of the layer of the tiles.
+        :param tiles: :class:`TileManager` of the same type.
+        :param tiles_width: Width of the layer of `tiles`.
+        """
+        if not tiles_width:
+            return
+        w = min(tiles_width, width - x)
+        h = min(len(tiles) // tiles_width, height - y)
+        if w <= 0 or h <= 0:
+            return
+        size = self.tile_size
+        src = memoryview(tiles._buffer())
+        dst = self.data
+        row = w * size
+        src_row = tiles_width * size
+        if w == width == tiles_width:
+            dst[y*row:(y+h)*row] = src[:h*row]
+            return
+        for i in range(h):
+            start = ((y+i)*width + x) * size
+            dst[start:start+row] = src[i*src_row:i*src_row+row]
+
+    def _get_runs(self):
+        """Returns the skip compressed data and the prefix sums of the runs,
+        the position of the first tile of every run."""
+        if callable(self._runs):
+            self._runs = self._runs()
+        if self._run_starts is None:
+            starts = array('L')
+            position = 0
+            for skip in memoryview(self._runs)[2::4]:
+                starts.append(position)
+                position += skip + 1
+            starts.append(position)
+            self._run_starts = starts
+        return self._runs, self._run_starts
+
+    def _expand_runs(self):
+        data = expand_tile_runs(self._get_runs()[0])
+        self._runs = self._run_starts = None
+        return data
+
+    def iter_runs(self):
+        """Yields the tiles as runs of identical tiles, as ``(index, flags,
+        count)`` tuples. Only for normal tiles."""
+        if self._loader is not None and self._runs is not None:
+            runs, starts = self._get_runs()
+            for i in range(len(starts) - 1):
+                yield runs[i*4], runs[i*4+1], starts[i+1] - starts[i]
+            return
+        data = memoryview(self._buffer())
+        for (index, flags), run in groupby(zip(data[0::4], data[1::4])):
+            yield index, flags, sum(1 for _ in run)
+
+    def compressed(self):
+        """Returns the tiles as skip compressed data, see
+        :func:`compress_tile_runs`."""
+        if self._loader is not None and self._runs is not None:
+            return bytes(self._get_runs()[0])
+        return compress_tile_runs(self._buffer())
+
+    @property
+    def tiles(self):
+        """List of the raw tiles, each one as its own string.
+
+        Builds a new list on every access, prefer :attr:`data`.
+        """
+        data = self._buffer()
+        size = self.tile_size
+        return [bytes(data[i:i+size]) for i in range(0, len(data), size)]
+
+    @tiles.setter
+    def tiles(self, value):
+        self.data = value
+
+    def _view(self, offset):
+        if offset >= self.tile_size:
+            raise ValueError('The tiles are only {0} bytes long'.format(
+                self.tile_size))
+        return memoryview(self.data)[offset::self.tile_size]
+
+    @property
+    def indices(self):
+        """Strided view on the index byte of every tile.
+
+        The views are writable, so they unshare the data of a :meth:`copy`.
+        """
+        return self._view(0)
+
+    @property
+    def flags(self):
+        """Strided view on the flags byte of every tile."""
+        return self._view(1)
+
+    @property
+    def skips(self):
+        """Strided view on the skip byte of every tile. Not for tele tiles."""
+        return self._view(2)
+
+    @property
+    def reserved(self):
+        """Strided view on the reserved byte of every tile. Not for tele
+        tiles."""
+        return self._view(3)
+
+    def _offset(self, k):
+        length = len(self)
+        if k < 0:
+            k += length
+        if not 0 <= k < length:
+            raise IndexError('tile index out of range')
+        return k * self.tile_size
 
     def __getitem__(self, value):
         if isinstance(value, slice):
-            return TileManager(data=self.tiles[value])
+            size = self.tile_size
+            start, stop, step = value.indices(len(self))
+            buffer = self._buffer()
+            if step == 1:
+                data = buffer[start*size:stop*size]
+            else:
+                data = [buffer[i*size:(i+1)*size]
+                        for i in range(start, stop, step)]
+            return TileManager(data=data, _type=self.type)
+        if self._loader is not None and self._runs is not None:
+            runs, starts = self._get_runs()
+            self._offset(value)
+            if value < 0:
+                value += starts[-1]
+            index, flags, skip, reserved = unpack_from(
+                '4B', runs, (bisect_right(starts, value) - 1) * 4)
+            return Tile(index=index, flags=flags, reserved=reserved)
+        offset = self._offset(value)
+        data = self._buffer()
         if self.type == 1:
-            return TeleTile(self.tiles[value])
+            return TeleTile(data[offset:offset+2])
         if self.type == 2:
-            return SpeedupTile(self.tiles[value])
-        return self._string_to_tile(self.tiles[value])
+            return SpeedupTile(data[offset:offset+4])
+        index, flags, skip, reserved = unpack_from('4B', data, offset)
+        return Tile(index=index, flags=flags, skip=skip, reserved=reserved)
 
     def __setitem__(self, k, v):
-        if isinstance(v, str):
-            if len(v) != 4:
-                raise ValueError('The string must be exactly 4 chars long.')
-            self.tiles[k] = v.encode()
+        if isinstance(v, (str, bytes)):
+            if len(v) != self.tile_size:
+                raise ValueError('The string must be exactly {0} chars '
+                                 'long.'.format(self.tile_size))
+            if isinstance(v, str):
+                v = v.encode()
         else:
-            self.tiles[k] = self._tile_to_string(v)
+            v = self._tile_to_string(v)
+        offset = self._offset(k)
+        data = self.data
+        old = data[offset]
+        data[offset:offset+self.tile_size] = v
+        if self.index is not None and data[offset] != old:
+            self.index.move(offset // self.tile_size, old, data[offset])
+
+    def __iter__(self):
+        if self._loader is not None and self._runs is not None:
+            runs, starts = self._get_runs()
+            for i in range(len(starts) - 1):
+                index, flags, skip, reserved = unpack_from('4B', runs, i * 4)
+                for j in range(skip + 1):
+                    yield Tile(index=index, flags=flags, reserved=reserved)
+            return
+        for i in range(len(self)):
+            yield self[i]
+
+    def as_array(self, shape=None):
+        """Returns a NumPy structured array viewing the raw tile data.
+
+        :param shape: Optional shape of the array, e.g. ``(height, width)``
+        :raises: ImportError if NumPy is not installed
+
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required for array access to tiles')
+        array = numpy.frombuffer(self.data, numpy.dtype(self.dtypes[self.type]))
+        if shape is not None:
+            array = array.reshape(shape)
+        return array
 
     def __len__(self):
-        return len(self.tiles)
+        if self._loader is not None and self._runs is not None:
+            return self._get_runs()[1][-1]
+        return len(self._buffer()) // self.tile_size
 
     def _tile_to_string(self, tile):
         if self.type == 1:
@@ -602,6 +1190,106 @@ class TileManager(object):
     def __repr__(self):
         return '<TileManager ({0})>'.format(len(self))
 
+class TileIndex(object):
+    """Histogram of the tile indices of a layer and the positions of the
+    tiles of every index, built by :meth:`TileManager.build_index`.
+
+    Positions are tile numbers, ``y * width + x``. Air tiles are only
+    counted, their positions are not kept.
+
+    :param data: Raw tile data
+    """
+
+    def __init__(self, data=None):
+        # number of tiles by index
+        self.counts = array('L', bytes(256 * array('L').itemsize))
+        # sorted positions by index
+        self._positions = {}
+        if not data:
+            return
+        indices = memoryview(data)[0::4]
+        if numpy is not None:
+            values = numpy.frombuffer(bytes(indices), numpy.uint8)
+            counts = numpy.bincount(values, minlength=256)
+            # positions grouped by index, in order within every index
+            order = numpy.argsort(values, kind='stable')
+            ends = numpy.cumsum(counts)
+            self.counts = array('L', counts.tolist())
+            for index in numpy.flatnonzero(counts[1:]) + 1:
+                self._positions[int(index)] = array(
+                    'L', order[ends[index] - counts[index]:ends[index]].tolist())
+        else:
+            indices = bytes(indices)
+            for index, count in Counter(indices).items():
+                self.counts[index] = count
+                if index:
+                    self._positions[index] = positions = array('L')
+                    value = bytes((index,))
+                    position = indices.find(value)
+                    while position != -1:
+                        positions.append(position)
+                        position = indices.find(value, position + 1)
+
+    def __contains__(self, index):
+        return self.counts[index] > 0
+
+    def positions(self, index):
+        """Returns the sorted positions of the tiles with an index, ``None``
+        for air."""
+        if not index:
+            return None
+        return self._positions.get(index, array('L'))
+
+    def move(self, position, old, new):
+        """Updates the index for a tile changing from `old` to `new`."""
+        self.counts[old] -= 1
+        self.counts[new] += 1
+        if old:
+            positions = self._positions[old]
+            del positions[bisect_left(positions, position)]
+            if not positions:
+                del self._positions[old]
+        if new:
+            positions = self._positions.setdefault(new, array('L'))
+            positions.insert(bisect_left(positions, position), position)
+
+    def copy(self):
+        index = TileIndex()
+        index.counts = array('L', self.counts)
+        index._positions = dict((key, array('L', positions)) for key, positions
+                                in self._positions.items())
+        return index
+
+def expand_tile_runs(data):
+    """Expands skip compressed tile data, like it is saved in layers of
+    version 4. Every tile is followed by as many copies of itself as its
+    skip byte says.
+
+    :returns: Raw tile data with one tile per tile, all with skip 0
+
+    """
+    expanded = bytearray()
+    for offset in range(0, len(data), 4):
+        tile = bytes(data[offset:offset+2]) + b'\x00' + bytes(data[offset+3:offset+4])
+        expanded += tile * (data[offset+2] + 1)
+    return expanded
+
+def compress_tile_runs(data):
+    """Skip compresses raw tile data: runs of up to 256 tiles with the same
+    index, flags and reserved byte are saved as the first tile with the
+    length of the run - 1 as skip."""
+    compressed = bytearray()
+    # compare whole tiles as integers, without the skip byte
+    mask = array('I', b'\xff\xff\x00\xff')[0]
+    for word, run in groupby(word & mask for word in array('I', bytes(data))):
+        count = sum(1 for _ in run)
+        tile = bytearray(pack('I', word))
+        while count > 0:
+            tile[2] = min(count, 256) - 1
+            compressed += tile
+            count -= 256
+    return compressed
+
 class Tile(object):
     """Represents a tile of a tilelayer."""
 
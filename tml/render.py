@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+    Renders tilelayers to images.
+
+    Every mapres is decoded once and the tiles are cut out of it and cached
+    per combination of index and flags, so pasting a tile is a plain copy.
+
+    With NumPy installed, whole layers can be rendered as arrays instead: the
+    tiles are gathered from an :class:`ArrayAtlas` by fancy indexing and the
+    layers are alpha blended as arrays.
+
+    Both can render bands of tile rows, which can be written to a png one
+    after another with :func:`write_png` to never hold the whole image.
+
+    :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+from collections import namedtuple
+from itertools import groupby
+import os
+
+from PIL import Image
+import png
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .constants import TML_DIR, R_TILEINDEX, TILEFLAG_VFLIP, TILEFLAG_HFLIP, \
+     TILEFLAG_ROTATE
+
+TILE_SIZE = 64
+TILEFLAGS = TILEFLAG_VFLIP | TILEFLAG_HFLIP | TILEFLAG_ROTATE
+
+# decoded external mapres, they are the same for every map
+_mapres_cache = {}
+
+# index of the rotated and flipped variant of a tile in ArrayAtlas, by flags
+VARIANTS = bytes(bytearray((flags & (TILEFLAG_VFLIP | TILEFLAG_HFLIP)) |
+                           (4 if flags & TILEFLAG_ROTATE else 0)
+                           for flags in range(256)))
+
+# whether tiles are drawn, by index. The last entry is the empty tile of
+# ArrayAtlas
+DRAWN_TILES = [False] + [True] * 255 + [False]
+DRAWN_GAME_TILES = [index != 0 and index in R_TILEINDEX
+                    for index in range(256)] + [False]
+
+# a tilelayer prepared for rendering to arrays, indices and flags are
+# (height, width) arrays
+RenderLayer = namedtuple('RenderLayer', 'indices flags atlas game')
+
+
+def load_mapres(image=None):
+    """Returns the decoded mapres of an image as RGBA PIL image.
+
+    :param image: :class:`Image <tml.items.Image>`, ``None`` for the
+                  entities.
+    :raises: IOError if an external mapres does not exist
+
+    """
+    if image is not None and not image.external:
+        return Image.frombytes(mode='RGBA', size=(image.width, image.height),
+                               data=image.data)
+    name = 'entities' if image is None else image.name.decode('utf-8')
+    mapres = _mapres_cache.get(name)
+    if mapres is None:
+        src = os.sep.join([TML_DIR, 'mapres', os.extsep.join([name, 'png'])])
+        mapres = Image.open(src).convert('RGBA')
+        _mapres_cache[name] = mapres
+    return mapres
+
+
+def scale_mapres(mapres, tile_size):
+    """Scales a mapres to 16x16 tiles of `tile_size` pixels.
+
+    Mapres are shrunk with a box filter, so every pixel is the average of
+    the pixels it covers and at 1 pixel per tile, every tile is its average
+    colour.
+
+    """
+    size = (16 * tile_size, 16 * tile_size)
+    if mapres.size == size:
+        return mapres
+    if mapres.width > size[0] and mapres.height > size[1]:
+        return mapres.resize(size, Image.BOX)
+    return mapres.resize(size, Image.LANCZOS)
+
+
+def tile_grid(layer):
+    """Returns the indices and flags of all tiles of the layer as two strings
+    with one byte per tile, with skipped tiles filled in."""
+    # read the shared data of a cached map without copying it
+    data = memoryview(layer.tiles._buffer())
+    indices = bytes(data[0::4])
+    flags = bytes(data[1::4])
+    skips = bytes(data[2::4])
+    if not any(skips):
+        return indices, flags
+    expanded_indices = bytearray()
+    expanded_flags = bytearray()
+    for index, flag, skip in zip(indices, flags, skips):
+        expanded_indices.extend([index] * (skip + 1))
+        expanded_flags.extend([flag] * (skip + 1))
+    size = layer.width * layer.height
+    return bytes(expanded_indices[:size]), bytes(expanded_flags[:size])
+
+
+class TileAtlas(object):
+    """Tiles of one mapres, cut out and transformed on demand and cached.
+
+    :param image: :class:`Image <tml.items.Image>` of the layer, ``None`` for
+                  the entities.
+    :param tile_size: Size of the rendered tiles in pixels.
+    """
+
+    def __init__(self, image=None, tile_size=TILE_SIZE):
+        self.mapres = scale_mapres(load_mapres(image), tile_size)
+        self.tile_size = tile_size
+        self._tiles = {}
+
+    def tile(self, index, flags=0):
+        """Returns the tile with the given index, rotated and flipped like
+        the flags say."""
+        key = (index, flags & TILEFLAGS)
+        tile = self._tiles.get(key)
+        if tile is None:
+            size = self.tile_size
+            x, y = index % 16, index // 16
+            tile = self.mapres.crop((x * size, y * size,
+                                     (x + 1) * size, (y + 1) * size))
+            if flags & TILEFLAG_ROTATE:
+                tile = tile.rotate(-90)
+            if flags & TILEFLAG_VFLIP:
+                tile = tile.transpose(Image.FLIP_LEFT_RIGHT)
+            if flags & TILEFLAG_HFLIP:
+                tile = tile.transpose(Image.FLIP_TOP_BOTTOM)
+            self._tiles[key] = tile
+        return tile
+
+    def run(self, index, flags=0, count=1):
+        """Returns `count` identical tiles next to each other.
+
+        Runs are not cached, there are too many different lengths of them.
+        """
+        tile = self.tile(index, flags)
+        if count == 1:
+            return tile
+        run = Image.new('RGBA', (self.tile_size * count, self.tile_size))
+        for i in range(count):
+            run.paste(tile, (i * self.tile_size, 0))
+        return run
+
+
+def paste_row(canvas, indices, flags, top, atlas, game=False):
+    """Pastes one row of tiles onto a PIL image, looking up the tile once
+    per run of identical tiles. Tiles with index 0 are empty and not drawn.
+
+    :param indices: Tile indices of the row, one byte per tile.
+    :param flags: Tile flags of the row, one byte per tile.
+    :param top: Pixel row of the canvas to paste the tiles at.
+
+    """
+    size = atlas.tile_size
+    x = 0
+    for (index, flag), run in groupby(zip(indices, flags)):
+        count = sum(1 for _ in run)
+        if game:
+            flag = 0
+        if index and (not game or index in R_TILEINDEX):
+            tile = atlas.tile(index, flag)
+            for i in range(x, x + count):
+                canvas.paste(tile, (i * size, top), tile)
+        x += count
+
+
+def render_tilelayer(canvas, layer, atlas, game=False, progress=None):
+    """Pastes the tiles of a tilelayer onto a PIL image. Tiles with index 0
+    are empty and not drawn.
+
+    :param canvas: RGBA PIL image, the layer is drawn at its top left corner.
+    :param atlas: :class:`TileAtlas` of the layer image.
+    :param game: Draw the tiles of a gamelayer, known entities only and
+                 without flags.
+    :param progress: Callable, called with the row after each row.
+
+    """
+    indices, flags = tile_grid(layer)
+    width = layer.width
+    for y in range(layer.height):
+        paste_row(canvas, indices[y*width:(y+1)*width],
+                  flags[y*width:(y+1)*width], y * atlas.tile_size, atlas, game)
+        if progress is not None:
+            progress(y)
+
+
+def image_bands(layers, width, height, tile_size=TILE_SIZE, band_rows=16):
+    """Renders a stack of layers band by band with PIL.
+
+    Besides the band, only the tiles of the atlases are kept, so the memory
+    needed does not grow with the size of the map.
+
+    :param layers: List of ``(layer, atlas)`` tuples, bottom layer first, see
+                   :func:`tilelayer_atlases`.
+    :param width: Width in tiles.
+    :param height: Height in tiles.
+    :returns: Generator of RGBA PIL images of `band_rows` tile rows each
+
+    """
+    grids = [tile_grid(layer) + (layer, atlas) for layer, atlas in layers]
+    for start in range(0, height, band_rows):
+        stop = min(start + band_rows, height)
+        band = Image.new('RGBA', (width * tile_size, (stop - start) * tile_size))
+        for indices, flags, layer, atlas in grids:
+            w = layer.width
+            for y in range(start, min(stop, layer.height)):
+                paste_row(band, indices[y*w:(y+1)*w], flags[y*w:(y+1)*w],
+                          (y - start) * tile_size, atlas, layer.is_gamelayer)
+        yield band
+
+
+def write_png(f, bands, width, height):
+    """Writes RGBA bands to a png file, one band at a time.
+
+    :param f: File object opened for binary writing.
+    :param bands: Iterable of RGBA PIL images or arrays, all `width` pixels
+                  wide, which are together `height` pixels high.
+
+    """
+    def rows():
+        stride = width * 4
+        for band in bands:
+            data = memoryview(band.tobytes())
+            for offset in range(0, len(data), stride):
+                yield data[offset:offset+stride]
+    writer = png.Writer(width=width, height=height, greyscale=False, alpha=True)
+    writer.write(f, rows())
+
+
+def tilelayer_atlases(layers, images, atlas_class=TileAtlas, tile_size=TILE_SIZE):
+    """Returns the renderable tilelayers with their atlas, as list of
+    ``(layer, atlas)`` tuples. Layers with the same image share the atlas.
+
+    Layers without an image (except the gamelayer) and layers with a missing
+    external image are left out.
+
+    """
+    atlases = {}
+    result = []
+    for layer in layers:
+        if layer.is_gamelayer:
+            # the gamelayer is drawn with the entities mapres
+            image_id = None
+        elif 0 <= layer.image_id < len(images):
+            image_id = layer.image_id
+        else:
+            continue
+        if image_id not in atlases:
+            try:
+                atlases[image_id] = atlas_class(
+                    images[image_id] if image_id is not None else None, tile_size)
+            except IOError:
+                atlases[image_id] = None
+        if atlases[image_id] is not None:
+            result.append((layer, atlases[image_id]))
+    return result
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('NumPy is required to render to arrays')
+
+
+class ArrayAtlas(object):
+    """Tiles of one mapres as NumPy array, for rendering whole layers at once.
+
+    The rotated and flipped variants of the tiles are built once per flags
+    combination when they are needed first. Index 256 is an empty tile.
+
+    :param image: :class:`Image <tml.items.Image>` of the layer, ``None`` for
+                  the entities.
+    :param tile_size: Size of the rendered tiles in pixels.
+    """
+
+    def __init__(self, image=None, tile_size=TILE_SIZE):
+        _require_numpy()
+        mapres = scale_mapres(load_mapres(image), tile_size)
+        self.tile_size = tile_size
+        tiles = numpy.asarray(mapres).reshape(16, tile_size, 16, tile_size, 4)
+        tiles = tiles.transpose(0, 2, 1, 3, 4).reshape(256, tile_size, tile_size, 4)
+        empty = numpy.zeros((1, tile_size, tile_size, 4), numpy.uint8)
+        self._variants = {0: numpy.concatenate([tiles, empty])}
+        # don't bother drawing fully transparent tiles
+        alpha = tiles[..., 3].reshape(256, -1)
+        self.transparent = numpy.append(alpha.max(axis=1) == 0, True)
+        self.drawn = numpy.array(DRAWN_TILES)
+        self.drawn_game = numpy.array(DRAWN_GAME_TILES)
+
+    def variant(self, variant):
+        """Returns all tiles rotated and flipped like the variant says,
+        see :data:`VARIANTS`."""
+        tiles = self._variants.get(variant)
+        if tiles is None:
+            tiles = self._variants[0]
+            if variant & 4:
+                tiles = numpy.rot90(tiles, -1, axes=(1, 2))
+            if variant & TILEFLAG_VFLIP:
+                tiles = tiles[:, :, ::-1]
+            if variant & TILEFLAG_HFLIP:
+                tiles = tiles[:, ::-1]
+            tiles = numpy.ascontiguousarray(tiles)
+            self._variants[variant] = tiles
+        return tiles
+
+    def draw(self, canvas, indices, flags, game=False):
+        """Copies a region of tiles onto a transparent canvas.
+
+        Only the tiles which are not empty are touched.
+
+        :param canvas: ``(rows, columns, tile_size, tile_size, 4)`` view on
+                       an RGBA array, see :func:`tile_view`
+        :param indices: ``(rows, columns)`` array with the tile indices
+        :param flags: ``(rows, columns)`` array with the tile flags
+        :param game: Draw gamelayer tiles, known entities only and without
+                     flags.
+        :returns: ``False`` if nothing was drawn at all
+
+        """
+        drawn = self.drawn_game if game else self.drawn
+        rows, columns = numpy.nonzero(drawn[indices] & ~self.transparent[indices])
+        if not len(rows):
+            return False
+        indices = indices[rows, columns]
+        if game:
+            canvas[rows, columns] = self._variants[0][indices]
+            return True
+        variants = numpy.frombuffer(VARIANTS, numpy.uint8)[flags[rows, columns]]
+        for variant in numpy.unique(variants):
+            mask = variants == variant
+            canvas[rows[mask], columns[mask]] = \
+                self.variant(int(variant))[indices[mask]]
+        return True
+
+
+def tile_view(pixels, tile_size):
+    """Returns a ``(rows, columns, tile_size, tile_size, 4)`` view on an RGBA
+    array, to address the pixels tile by tile."""
+    height, width = pixels.shape[:2]
+    return pixels.reshape(height // tile_size, tile_size, width // tile_size,
+                          tile_size, 4).swapaxes(1, 2)
+
+
+def prepare_tilelayers(layers, images, tile_size=TILE_SIZE):
+    """Returns the renderable tilelayers as list of :data:`RenderLayer`."""
+    _require_numpy()
+    result = []
+    for layer, atlas in tilelayer_atlases(layers, images, ArrayAtlas, tile_size):
+        indices, flags = tile_grid(layer)
+        shape = (layer.height, layer.width)
+        result.append(RenderLayer(
+            numpy.frombuffer(indices, numpy.uint8).reshape(shape),
+            numpy.frombuffer(flags, numpy.uint8).reshape(shape),
+            atlas, layer.is_gamelayer))
+    return result
+
+
+def render_rows(layers, start, stop, width, tile_size=TILE_SIZE):
+    """Renders the tile rows from `start` to `stop` of a stack of layers.
+
+    Every layer is laid out as a whole array first and then blended over the
+    layers below in one go.
+
+    :param layers: List of :data:`RenderLayer`, bottom layer first.
+    :param width: Width in tiles.
+    :returns: RGBA array of ``(stop-start)*tile_size`` pixel rows
+
+    """
+    size = (width * tile_size, (stop - start) * tile_size)
+    band = Image.new('RGBA', size)
+    pixels = numpy.empty((size[1], size[0], 4), numpy.uint8)
+    view = tile_view(pixels, tile_size)
+    for layer in layers:
+        indices = layer.indices[start:stop, :width]
+        rows, columns = indices.shape
+        pixels.fill(0)
+        if layer.atlas.draw(view[:rows, :columns], indices,
+                            layer.flags[start:stop, :width], layer.game):
+            band.alpha_composite(Image.fromarray(pixels, 'RGBA'))
+    return numpy.asarray(band)
+
+
+def array_bands(layers, width, height, tile_size=TILE_SIZE, band_rows=16):
+    """Renders a stack of layers band by band to arrays.
+
+    :returns: Generator of RGBA arrays of `band_rows` tile rows each, see
+              :func:`render_rows`
+
+    """
+    for start in range(0, height, band_rows):
+        yield render_rows(layers, start, min(start + band_rows, height), width,
+                          tile_size)
+
+
+def render_array(layers, width, height, tile_size=TILE_SIZE, band_rows=16):
+    """Renders a stack of layers to one RGBA array.
+
+    The layers are rendered and blended in bands of `band_rows` tile rows, to
+    keep the temporary arrays small.
+
+    """
+    canvas = numpy.empty((height * tile_size, width * tile_size, 4), numpy.uint8)
+    top = 0
+    for band in array_bands(layers, width, height, tile_size, band_rows):
+        canvas[top:top+len(band)] = band
+        top += len(band)
+    return canvas
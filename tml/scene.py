@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+    Renders the whole scene of a map: every group in order, with parallax,
+    offsets and clipping, quadlayers and the colours of the tilelayers.
+
+    A map is a scene seen through a camera, the parallax of a group only
+    means something for a given camera position. The scene is rendered as
+    one big screen covering the game layer, with the camera in its center
+    unless told otherwise, so groups with a parallax are shifted as they
+    would be for a player standing there. Envelopes are not animated.
+
+    The image is rendered in bands of tile rows, which are spread across a
+    pool of processes and written to the png one after another. Needs NumPy.
+
+    :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+from struct import unpack
+
+from PIL import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import render
+from .items import TileLayer, QuadLayer
+
+# world units per tile
+WORLD_TILE_SIZE = 32
+# quad points and texture coordinates are fixed point numbers
+FIXED_ONE = 1024
+# the two triangles of a quad, by point index
+QUAD_TRIANGLES = ((0, 1, 2), (1, 3, 2))
+
+# a tilelayer, positioned in output pixels. indices and flags are (height,
+# width) arrays, color a (r, g, b, a) tuple, clip None or a (x0, y0, x1, y1)
+# pixel rectangle
+SceneTiles = namedtuple('SceneTiles', 'indices flags atlas game color x y clip')
+# a quadlayer: quads is a (n, 38) array of the raw quads, texture an RGBA
+# array or None, (x, y) the position of the group origin and scale the size
+# of one world unit, in output pixels
+SceneQuads = namedtuple('SceneQuads', 'quads texture x y scale clip')
+
+# scene of the worker processes, see _init_worker
+_scene = None
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('NumPy is required to render scenes')
+
+
+def prepare_scene(teemap, tile_size=render.TILE_SIZE, camera=None,
+                  entities=False):
+    """Collects the layers of all groups of a map, bottom layer first, as
+    :data:`SceneTiles` and :data:`SceneQuads`.
+
+    :param camera: ``(x, y)`` camera position in world units, defaults to
+                   the center of the game layer.
+    :param entities: Also render the game layer with the entities.
+    :returns: ``(layers, width, height)``, the size in tiles of the game layer
+    :raises: ValueError if the map has no game layer
+
+    """
+    _require_numpy()
+    game = next((layer for layer in teemap.layers if layer.is_gamelayer), None)
+    if game is None:
+        raise ValueError('The map has no game layer')
+    width, height = game.width, game.height
+    if camera is None:
+        camera = (width * WORLD_TILE_SIZE / 2.0, height * WORLD_TILE_SIZE / 2.0)
+    scale = float(tile_size) / WORLD_TILE_SIZE
+
+    tile_layers = [layer for group in teemap.groups for layer in group.layers
+                   if isinstance(layer, TileLayer) and (
+                       layer.game == 0 or entities and layer.is_gamelayer)]
+    atlases = dict((id(layer), atlas) for layer, atlas in
+                   render.tilelayer_atlases(tile_layers, teemap.images,
+                                            render.ArrayAtlas, tile_size))
+    textures = {}
+
+    layers = []
+    for group in teemap.groups:
+        # where the origin of the group ends up in the world, seen from the
+        # camera
+        x = -group.offset_x - camera[0] * (group.parallax_x / 100.0 - 1)
+        y = -group.offset_y - camera[1] * (group.parallax_y / 100.0 - 1)
+        clip = None
+        if group.use_clipping:
+            clip = tuple(int(round(value * scale)) for value in
+                         (group.clip_x, group.clip_y, group.clip_x + group.clip_w,
+                          group.clip_y + group.clip_h))
+        for layer in group.layers:
+            if isinstance(layer, TileLayer):
+                atlas = atlases.get(id(layer))
+                if atlas is None:
+                    continue
+                indices, flags = render.tile_grid(layer)
+                shape = (layer.height, layer.width)
+                layers.append(SceneTiles(
+                    numpy.frombuffer(indices, numpy.uint8).reshape(shape),
+                    numpy.frombuffer(flags, numpy.uint8).reshape(shape),
+                    atlas, layer.is_gamelayer, tuple(layer.color),
+                    int(round(x * scale)), int(round(y * scale)), clip))
+            elif isinstance(layer, QuadLayer) and len(layer.quads):
+                if layer.image_id < 0:
+                    texture = None
+                elif layer.image_id not in textures:
+                    try:
+                        texture = numpy.asarray(render.load_mapres(
+                            teemap.images[layer.image_id]))
+                    except (IOError, IndexError):
+                        texture = None
+                    textures[layer.image_id] = texture
+                    if texture is None:
+                        continue
+                else:
+                    texture = textures[layer.image_id]
+                    if texture is None:
+                        continue
+                quads = numpy.array([unpack('38i', quad)
+                                     for quad in layer.quads._list()], numpy.int32)
+                layers.append(SceneQuads(quads, texture, x * scale, y * scale,
+                                         scale, clip))
+    return layers, width, height
+
+
+def _clip_box(box, clip):
+    """Intersects two ``(x0, y0, x1, y1)`` rectangles."""
+    if clip is None:
+        return box
+    return (max(box[0], clip[0]), max(box[1], clip[1]),
+            min(box[2], clip[2]), min(box[3], clip[3]))
+
+
+def _render_tiles(layer, box):
+    """Renders the part of a tilelayer within the pixel rectangle `box`.
+
+    :returns: RGBA array of the size of the box
+
+    """
+    size = layer.atlas.tile_size
+    x0, y0, x1, y1 = box
+    # tile rows and columns covering the box
+    rows = (max(0, (y0 - layer.y) // size),
+            min(layer.indices.shape[0], -(-(y1 - layer.y) // size)))
+    columns = (max(0, (x0 - layer.x) // size),
+               min(layer.indices.shape[1], -(-(x1 - layer.x) // size)))
+    pixels = numpy.zeros((y1 - y0, x1 - x0, 4), numpy.uint8)
+    if rows[0] >= rows[1] or columns[0] >= columns[1]:
+        return pixels
+    tiles = numpy.zeros(((rows[1] - rows[0]) * size,
+                         (columns[1] - columns[0]) * size, 4), numpy.uint8)
+    if not layer.atlas.draw(render.tile_view(tiles, size),
+                            layer.indices[rows[0]:rows[1], columns[0]:columns[1]],
+                            layer.flags[rows[0]:rows[1], columns[0]:columns[1]],
+                            layer.game):
+        return pixels
+    # top left corner of the rendered tiles in the box
+    left = layer.x + columns[0] * size - x0
+    top = layer.y + rows[0] * size - y0
+    src = tiles[max(0, -top):y1 - y0 - top, max(0, -left):x1 - x0 - left]
+    pixels[max(0, top):max(0, top) + src.shape[0],
+           max(0, left):max(0, left) + src.shape[1]] = src
+    if layer.color != (255, 255, 255, 255):
+        tint = numpy.array(layer.color, numpy.uint16)
+        pixels[...] = pixels * tint // 255
+    return pixels
+
+
+def _render_quads(layer, box):
+    """Rasterizes the quads of a quadlayer within the pixel rectangle `box`.
+
+    Every quad is drawn as two triangles, texture coordinates and colours
+    are interpolated between the corners and the quads are blended over
+    each other in order.
+
+    :returns: RGBA array of the size of the box
+
+    """
+    x0, y0, x1, y1 = box
+    # premultiplied colours
+    pixels = numpy.zeros((y1 - y0, x1 - x0, 4), numpy.float32)
+    # corners of all quads in box pixels, only look at those in the box
+    points = layer.quads[:, :8].reshape(-1, 4, 2) * (layer.scale / FIXED_ONE)
+    points += (layer.x - x0, layer.y - y0)
+    lefts, tops = numpy.floor(points.min(axis=1)).astype(int).T
+    rights, bottoms = numpy.ceil(points.max(axis=1)).astype(int).T
+    visible = (lefts < x1 - x0) & (rights > 0) & (tops < y1 - y0) & (bottoms > 0)
+    if not visible.any():
+        return numpy.zeros((y1 - y0, x1 - x0, 4), numpy.uint8)
+    for i in numpy.nonzero(visible)[0]:
+        quad = layer.quads[i]
+        colors = quad[10:26].reshape(4, 4) / numpy.float32(255)
+        texcoords = quad[26:34].reshape(4, 2) / numpy.float32(FIXED_ONE)
+        left, top = max(lefts[i], 0), max(tops[i], 0)
+        right, bottom = min(rights[i], x1 - x0), min(bottoms[i], y1 - y0)
+        # pixel centers
+        px = numpy.arange(left, right, dtype=numpy.float32) + .5
+        py = numpy.arange(top, bottom, dtype=numpy.float32)[:, None] + .5
+        drawn = numpy.zeros((bottom - top, right - left), bool)
+        for triangle in QUAD_TRIANGLES:
+            (ax, ay), (bx, by), (cx, cy) = points[i][list(triangle)]
+            area = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+            if not area:
+                continue
+            # barycentric coordinates
+            wa = ((bx - px) * (cy - py) - (by - py) * (cx - px)) / area
+            wb = ((cx - px) * (ay - py) - (cy - py) * (ax - px)) / area
+            wc = 1 - wa - wb
+            # pixels on the shared edge belong to the first triangle only
+            inside = (wa >= 0) & (wb >= 0) & (wc >= 0) & ~drawn
+            if not inside.any():
+                continue
+            drawn |= inside
+            weights = numpy.stack([wa[inside], wb[inside], wc[inside]], axis=1)
+            color = weights.dot(colors[list(triangle)])
+            if layer.texture is not None:
+                u, v = weights.dot(texcoords[list(triangle)]).T
+                height, width = layer.texture.shape[:2]
+                texel = layer.texture[
+                    numpy.floor(v * height).astype(int) % height,
+                    numpy.floor(u * width).astype(int) % width]
+                color *= texel / numpy.float32(255)
+            alpha = color[:, 3:]
+            color[:, :3] *= alpha
+            region = pixels[top:bottom, left:right]
+            region[inside] = color + region[inside] * (1 - alpha)
+    alpha = pixels[..., 3:]
+    numpy.divide(pixels[..., :3], alpha, out=pixels[..., :3], where=alpha > 0)
+    return (pixels * 255 + .5).astype(numpy.uint8)
+
+
+def render_band(layers, top, bottom, width):
+    """Renders the pixel rows from `top` to `bottom` of a scene.
+
+    :param layers: Layers returned by :func:`prepare_scene`.
+    :param width: Width of the image in pixels.
+    :returns: RGBA array
+
+    """
+    band = Image.new('RGBA', (width, bottom - top))
+    for layer in layers:
+        box = _clip_box((0, top, width, bottom), layer.clip)
+        if box[0] >= box[2] or box[1] >= box[3]:
+            continue
+        if isinstance(layer, SceneTiles):
+            pixels = _render_tiles(layer, box)
+        else:
+            pixels = _render_quads(layer, box)
+        band.alpha_composite(Image.fromarray(pixels, 'RGBA'),
+                             (box[0], box[1] - top))
+    return numpy.asarray(band)
+
+
+def _init_worker(layers, width):
+    global _scene
+    _scene = (layers, width)
+
+
+def _render_worker(rows):
+    layers, width = _scene
+    return render_band(layers, rows[0], rows[1], width)
+
+
+def scene_bands(layers, width, height, tile_size=render.TILE_SIZE,
+                band_rows=16, workers=None):
+    """Renders a scene band by band on a pool of processes.
+
+    :param width: Width in tiles.
+    :param height: Height in tiles.
+    :param workers: Number of processes, defaults to the number of CPUs. With
+                    1, the bands are rendered in this process. At most twice
+                    as many bands are rendered ahead of the one yielded.
+    :returns: Generator of RGBA arrays of `band_rows` tile rows each, in order
+
+    """
+    _require_numpy()
+    pixel_width = width * tile_size
+    bands = [(start * tile_size, min(start + band_rows, height) * tile_size)
+             for start in range(0, height, band_rows)]
+    if workers == 1:
+        for top, bottom in bands:
+            yield render_band(layers, top, bottom, pixel_width)
+        return
+    ahead = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(layers, pixel_width)) as executor:
+        bands = iter(bands)
+        futures = deque(executor.submit(_render_worker, rows)
+                        for _, rows in zip(range(ahead), bands))
+        while futures:
+            band = futures.popleft().result()
+            rows = next(bands, None)
+            if rows is not None:
+                futures.append(executor.submit(_render_worker, rows))
+            yield band
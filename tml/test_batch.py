@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import shutil
+import unittest
+
+from . import batch
+from .batch import find_maps, import_func, process_map, scan, summary
+
+
+def count_gametiles(teemap):
+    return sum(1 for tile in teemap.gamelayer.tiles if tile.index)
+
+
+def unpicklable(teemap):
+    return lambda: teemap.width
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    submitted = 0
+
+    def submit(self, *args, **kwargs):
+        CountingExecutor.submitted += 1
+        return ThreadPoolExecutor.submit(self, *args, **kwargs)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('test_tmp')
+        with open('test_tmp/broken.map', 'wb') as f:
+            f.write(b'not a map')
+
+    def tearDown(self):
+        if os.path.isdir('test_tmp'):
+            shutil.rmtree('test_tmp')
+
+    def test_find_maps(self):
+        maps = find_maps(['tml/maps'])
+        self.assertEqual(len(maps), 13)
+        self.assertEqual(find_maps(['tml/maps/dm*.map']),
+                         [path for path in maps if 'dm' in path])
+        self.assertEqual(find_maps(['tml/maps/dm1.map']), ['tml/maps/dm1.map'])
+
+    def test_import_func(self):
+        self.assertIs(import_func('tml.batch:summary'), summary)
+        self.assertRaises(ValueError, import_func, 'tml.batch')
+
+    def test_process_map(self):
+        result = process_map(summary, 'tml/test_maps/vanilla.map')
+        self.assertEqual(result['result']['width'], 50)
+        self.assertEqual(result['result']['groups'], 7)
+        result = process_map(summary, 'test_tmp/broken.map')
+        self.assertIn('error', result)
+        self.assertNotIn('result', result)
+
+    def test_scan(self):
+        paths = ['tml/maps/dm1.map', 'tml/maps/ctf1.map', 'test_tmp/broken.map']
+        results = dict((result['map'], result) for result in
+                       scan(paths, count_gametiles, workers=2, lazy=True))
+        self.assertEqual(sorted(results), sorted(paths))
+        self.assertIn('error', results['test_tmp/broken.map'])
+        self.assertGreater(results['tml/maps/dm1.map']['result'], 0)
+
+    def test_scan_window(self):
+        batch.ProcessPoolExecutor = CountingExecutor
+        try:
+            results = scan(['tml/maps'], workers=1)
+            next(results)
+            self.assertLessEqual(CountingExecutor.submitted, 2)
+            self.assertEqual(len(list(results)), 12)
+            self.assertEqual(CountingExecutor.submitted, 13)
+        finally:
+            batch.ProcessPoolExecutor = ProcessPoolExecutor
+
+    def test_scan_unpicklable(self):
+        results = list(scan(['tml/maps/dm1.map', 'tml/maps/ctf1.map'],
+                            unpicklable, workers=2))
+        self.assertEqual(sorted(result['map'] for result in results),
+                         ['tml/maps/ctf1.map', 'tml/maps/dm1.map'])
+        for result in results:
+            self.assertIn('error', result)
+
+if __name__ == '__main__':
+    unittest.main()
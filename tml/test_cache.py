@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from .cache import DiskCache, MapCache, map_size
+from .items import Quad, Tile
+from .tml import Teemap
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('test_tmp')
+        self.cache = DiskCache('test_tmp/cache')
+
+    def tearDown(self):
+        if os.path.isdir('test_tmp'):
+            shutil.rmtree('test_tmp')
+
+    def test_load(self):
+        teemap = Teemap('tml/test_maps/vanilla')
+        self.assertEqual(self.cache.entries(), [])
+        for i in range(2):
+            cached = Teemap('tml/test_maps/vanilla', cache=self.cache)
+            self.assertEqual(len(self.cache.entries()), 1)
+            for layer, cached_layer in zip(teemap.layers, cached.layers):
+                if layer.type == 'tilelayer':
+                    self.assertEqual(cached_layer.tiles.data, layer.tiles.data)
+                else:
+                    self.assertEqual(cached_layer.quads.quads, layer.quads.quads)
+        lazy = Teemap('tml/test_maps/vanilla', lazy=True, cache=self.cache)
+        self.assertEqual(lazy.gamelayer.tiles.data, teemap.gamelayer.tiles.data)
+
+    def test_invalidate(self):
+        shutil.copy('tml/test_maps/vanilla.map', 'test_tmp/map.map')
+        Teemap('test_tmp/map', cache=self.cache)
+        teemap = Teemap('tml/maps/dm1')
+        teemap.save('test_tmp/map')
+        cached = Teemap('test_tmp/map', cache=self.cache)
+        self.assertEqual(len(self.cache.entries()), 2)
+        self.assertEqual(cached.gamelayer.tiles.data, teemap.gamelayer.tiles.data)
+
+    def test_entry(self):
+        Teemap('tml/test_maps/vanilla', cache=self.cache)
+        path = self.cache.entries()[0][2]
+        with open('tml/test_maps/vanilla.map', 'rb') as f:
+            key = self.cache.key(f)
+        entry = self.cache.get(key)
+        self.assertIsInstance(entry[0], memoryview)
+        entry.close()
+        # a damaged entry is a miss and removed
+        with open(path, 'r+b') as f:
+            f.truncate(10)
+        self.assertIsNone(self.cache.get(key))
+        self.assertFalse(os.path.exists(path))
+
+    def test_lazy_miss(self):
+        teemap = Teemap('tml/test_maps/vanilla', lazy=True, cache=self.cache)
+        self.assertEqual(self.cache.entries(), [])
+        self.assertIsNotNone(teemap.gamelayer.tiles._loader)
+        self.assertEqual(len(teemap.gamelayer.tiles), 50 * 50)
+
+    def test_evict(self):
+        Teemap('tml/test_maps/vanilla', cache=self.cache)
+        Teemap('tml/maps/dm1', cache=self.cache)
+        # using an entry makes it the most recent one
+        Teemap('tml/test_maps/vanilla', cache=self.cache)
+        entries = self.cache.entries()
+        self.assertEqual(len(entries), 2)
+        self.cache.evict(entries[-1][1])
+        self.assertEqual(self.cache.entries(), entries[-1:])
+        with open('tml/test_maps/vanilla.map', 'rb') as f:
+            self.assertEqual(entries[-1][2],
+                             self.cache._entry_path(self.cache.key(f)))
+        self.cache.clear()
+        self.assertEqual(self.cache.entries(), [])
+
+
+class TestMapCache(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('test_tmp')
+        shutil.copy('tml/test_maps/vanilla.map', 'test_tmp/vanilla.map')
+        self.cache = MapCache()
+
+    def tearDown(self):
+        if os.path.isdir('test_tmp'):
+            shutil.rmtree('test_tmp')
+
+    def test_get(self):
+        teemap = self.cache.get('test_tmp/vanilla')
+        other = self.cache.get('test_tmp/vanilla.map')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(len(self.cache), 1)
+        self.assertIn('test_tmp/vanilla', self.cache)
+        self.assertEqual(self.cache.size, map_size(teemap))
+        self.assertIsNot(teemap.gamelayer.tiles, other.gamelayer.tiles)
+        self.assertIs(teemap.gamelayer.tiles._buffer(),
+                      other.gamelayer.tiles._buffer())
+
+    def test_copy_on_write(self):
+        teemap = self.cache.get('test_tmp/vanilla')
+        index = teemap.gamelayer.tiles[0].index
+        teemap.gamelayer.tiles[0] = Tile(index + 1)
+        quad_layer = [layer for layer in teemap.layers
+                      if layer.type == 'quadlayer'][0]
+        quad_layer.quads.append(Quad())
+        teemap.images[0].name = b'changed'
+        other = self.cache.get('test_tmp/vanilla')
+        self.assertEqual(other.gamelayer.tiles[0].index, index)
+        self.assertEqual(teemap.gamelayer.tiles[0].index, index + 1)
+        other_quad_layer = [layer for layer in other.layers
+                            if layer.type == 'quadlayer'][0]
+        self.assertEqual(len(other_quad_layer.quads),
+                         len(quad_layer.quads) - 1)
+        self.assertNotEqual(other.images[0].name, b'changed')
+
+    def test_read_shared(self):
+        cached = self.cache.get('test_tmp/vanilla')
+        teemap = self.cache.get('test_tmp/vanilla')
+        teemap.export_to_png('test_tmp/vanilla.png', tile_size=4)
+        teemap.export_to_png('test_tmp/bands.png', tile_size=4, band_rows=8)
+        teemap.save('test_tmp/copy')
+        for layer, cached_layer in zip(teemap.layers, cached.layers):
+            if layer.type == 'tilelayer':
+                self.assertTrue(layer.tiles._data is cached_layer.tiles._data)
+            else:
+                self.assertTrue(layer.quads._quads is cached_layer.quads._quads)
+
+    def test_reload(self):
+        self.cache.get('test_tmp/vanilla')
+        teemap = Teemap('tml/maps/dm1')
+        teemap.save('test_tmp/vanilla')
+        self.assertEqual(self.cache.get('test_tmp/vanilla').width, teemap.width)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_evict(self):
+        self.cache.max_size = map_size(Teemap('test_tmp/vanilla'))
+        self.cache.get('tml/maps/dm1')
+        self.cache.get('test_tmp/vanilla')
+        self.assertNotIn('tml/maps/dm1', self.cache)
+        self.assertLessEqual(self.cache.size, self.cache.max_size)
+
+if __name__ == '__main__':
+    unittest.main()
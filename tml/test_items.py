@@ -1,9 +1,63 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from array import array
+import gc
+import hashlib
+import os
+import shutil
 import unittest
+import warnings
+import zlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from .items import Layer, TileLayer, TileManager, Tile, QuadLayer, QuadManager, \
-     Quad
+     Quad, Image, ImageData, check_png, compress_tile_runs, expand_tile_runs
+from .constants import TILEFLAG_HFLIP, TILEFLAG_ROTATE
+
+class TestImage(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('test_tmp')
+
+    def tearDown(self):
+        if os.path.isdir('test_tmp'):
+            shutil.rmtree('test_tmp')
+
+    def test_check_png(self):
+        self.assertTrue(check_png('tml/mapres/grass_main.png'))
+        with open('test_tmp/broken.png', 'wb') as f:
+            f.write(b'not a png' * 10)
+        self.assertFalse(check_png('test_tmp/broken.png'))
+        # a changed file is checked again
+        shutil.copy('tml/mapres/grass_main.png', 'test_tmp/broken.png')
+        self.assertTrue(check_png('test_tmp/broken.png'))
+        self.assertRaises(IOError, check_png, 'test_tmp/missing.png')
+
+    def test_init_warnings(self):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            Image(b'grass_main', external=True)
+            self.assertEqual(len(w), 0)
+            Image(b'missing', external=True)
+            self.assertEqual(len(w), 1)
+            self.assertIn('does not exist', str(w[0].message))
+
+    def test_image_data(self):
+        compressed = zlib.compress(b'\x01\x02\x03\x04' * 16)
+        image = Image(b'test', 4, 4, data=ImageData.pooled(compressed))
+        self.assertTrue(image.shared)
+        self.assertIsNone(image._shared._data)
+        other = Image(b'test', 4, 4, data=ImageData.pooled(compressed))
+        self.assertEqual(image.data, b'\x01\x02\x03\x04' * 16)
+        self.assertIs(other.data, image.data)
+        self.assertIsNone(image._shared._compressed)
+        del image, other
+        gc.collect()
+        self.assertNotIn(hashlib.sha1(compressed).digest(), ImageData.pool)
 
 class TestTileLayer(unittest.TestCase):
 
@@ -164,10 +218,165 @@ class TestTileLayer(unittest.TestCase):
         self.assertEqual(self.layer.get_tile(49, 48).index, 10)
         self.assertEqual(self.layer.get_tile(49, 49).index, 0)
 
+    def test_fill_replace(self):
+        self.layer.fill((48, 48, 5, 5), Tile(3, flags=TILEFLAG_HFLIP))
+        self.assertEqual(self.layer.get_tile(49, 49).index, 3)
+        self.assertEqual(self.layer.get_tile(47, 49).index, 0)
+        self.assertEqual(self.layer.count_by_index()[3], 4)
+        self.assertEqual(self.layer.replace({1: 3, 3: 1}), 30)
+        self.assertEqual(self.layer.get_tile(49, 49).index, 1)
+        self.assertTrue(self.layer.get_tile(49, 49).flags['hflip'])
+        self.assertEqual(self.layer.get_tile(20, 0).index, 3)
+        self.assertEqual(self.layer.replace(1, 0, rect=(0, 0, 50, 48)), 0)
+        self.assertEqual(self.layer.replace(3, 0, rect=(0, 0, 30, 2)), 2)
+        self.assertEqual(self.layer.find(3),
+                         [(40 + i, 0) for i in range(5)] +
+                         [(40 + i, 4) for i in range(10)] +
+                         [(45, 5 + i) for i in range(6)] +
+                         [(2, 48), (3, 48), (2, 49)])
+
+    def test_index(self):
+        counts = self.layer.count_by_index()
+        positions = self.layer.find(1)
+        index = self.layer.build_index()
+        self.assertIn(1, index)
+        self.assertNotIn(2, index)
+        self.assertEqual(self.layer.count_by_index(), counts)
+        self.assertEqual(self.layer.find(1), positions)
+        self.layer.set_tile(0, 0, Tile(2))
+        self.layer.tiles[20] = Tile(2)
+        self.assertEqual(self.layer.find(2), [(0, 0), (20, 0)])
+        self.assertEqual(self.layer.find(1), positions[1:])
+        self.assertEqual(index.counts[0], 2500 - 26 - 1)
+        self.layer.fill((0, 0, 2, 2), Tile(2))
+        self.assertEqual(self.layer.count_by_index()[2], 5)
+        self.layer.width = 10
+        self.assertEqual(self.layer.tiles.index.positions(2),
+                         array('L', [0, 1, 10, 11]))
+        self.assertEqual(self.layer.find(2),
+                         TileLayer.find(self.layer.select(0, 0, 10, 50), 2))
+
+    def test_apply_flags(self):
+        self.layer.apply_flags(rotate='r', rect=(20, 0, 1, 1))
+        tile = self.layer.get_tile(20, 0)
+        self.assertTrue(tile.flags['rotation'])
+        self.assertFalse(self.layer.get_tile(20, 1).flags['rotation'])
+        self.layer.apply_flags(rotate='l', hflip=True)
+        expected = Tile(1, flags=TILEFLAG_ROTATE)
+        expected.hflip()
+        expected.rotate('l')
+        self.assertEqual(self.layer.get_tile(20, 0), expected)
+
+    def test_race_tiles(self):
+        layer = TileLayer(10, 5, game=2)
+        layer.tele_tiles.data[(2*10+3)*2:(2*10+3)*2+2] = b'\x05\x1a'
+        selection = layer.select(3, 2, 4, 2)
+        self.assertEqual(selection.tele_tiles.type, 1)
+        self.assertEqual(len(selection.tele_tiles), 8)
+        self.assertEqual(selection.tele_tiles[0].number, 5)
+        self.assertIsNone(selection.speedup_tiles)
+        layer.width = 4
+        layer.height = 3
+        self.assertEqual(len(layer.tele_tiles), 12)
+        self.assertEqual(layer.get_tele_tile(3, 2).number, 5)
+        layer.draw(0, 0, selection)
+        self.assertEqual(layer.get_tele_tile(0, 0).number, 5)
+        self.assertEqual(layer.get_tele_tile(3, 2).number, 5)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_as_array(self):
+        array = self.layer.as_array()
+        self.assertEqual(array.shape, (50, 50))
+        self.assertEqual(array['index'][0, 20], 1)
+        self.assertEqual(array['index'][4, 40:50].tolist(), [1] * 10)
+        self.assertEqual(int((array['index'] == 1).sum()), 26)
+        array['index'][1, 2] = 7
+        self.assertEqual(self.layer.get_tile(2, 1).index, 7)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_set_array(self):
+        array = self.layer.as_array()[:10, :20].copy()
+        array['flags'] = 8
+        self.layer.set_array(array)
+        self.assertEqual((self.layer.width, self.layer.height), (20, 10))
+        self.assertEqual(len(self.layer.tiles), 200)
+        self.assertEqual(self.layer.get_tile(0, 4).index, 0)
+        self.assertEqual(self.layer.get_tile(19, 0).index, 0)
+        self.assertEqual(self.layer.get_tile(0, 0).flags['rotation'], True)
+        self.assertRaises(ValueError, self.layer.set_array, array[0])
+
 class TestTileManager(unittest.TestCase):
 
     def test_init(self):
-        pass
+        manager = TileManager(10)
+        self.assertEqual(len(manager), 10)
+        self.assertEqual(manager.data, bytearray(40))
+        self.assertEqual(len(TileManager(10, _type=1).data), 20)
+
+        manager = TileManager(data=b'\x01\x00\x00\x00\x02\x08\x00\x00')
+        self.assertEqual(len(manager), 2)
+        self.assertEqual(manager[1].index, 2)
+        self.assertTrue(manager[1].flags['rotation'])
+
+        manager = TileManager(tiles=[Tile(3), Tile(4)])
+        self.assertEqual([tile.index for tile in manager], [3, 4])
+
+    def test_setitem(self):
+        manager = TileManager(5)
+        manager[2] = Tile(7, skip=1)
+        manager[-1] = Tile(9)
+        self.assertEqual(manager[2], Tile(7, skip=1))
+        self.assertEqual(manager[4].index, 9)
+        self.assertEqual(len(manager.data), 20)
+        with self.assertRaises(IndexError):
+            manager[5] = Tile(1)
+        with self.assertRaises(ValueError):
+            manager[0] = 'abc'
+
+    def test_slice(self):
+        manager = TileManager(tiles=[Tile(i) for i in range(10)])
+        self.assertEqual([tile.index for tile in manager[2:5]], [2, 3, 4])
+        self.assertEqual([tile.index for tile in manager[::3]], [0, 3, 6, 9])
+
+    def test_views(self):
+        manager = TileManager(tiles=[Tile(i, flags=i % 4) for i in range(8)])
+        self.assertEqual(list(manager.indices), list(range(8)))
+        self.assertEqual(list(manager.flags), [i % 4 for i in range(8)])
+        manager.indices[3] = 42
+        self.assertEqual(manager[3].index, 42)
+        self.assertEqual(bytes(manager.skips), bytes(8))
+        tele = TileManager(4, _type=1)
+        self.assertRaises(ValueError, getattr, tele, 'skips')
+        self.assertRaises(ValueError, getattr, tele, 'reserved')
+
+    def test_set_raw(self):
+        tele = TileManager(4, _type=1)
+        tele[1] = b'\x05\x1a'
+        self.assertEqual(tele[1].number, 5)
+        self.assertRaises(ValueError, tele.__setitem__, 2, b'\x05\x1a\x00\x00')
+        self.assertEqual(len(tele.data), 8)
+
+    def test_runs(self):
+        data = bytearray(4 * 600)
+        data[400:412] = b'\x05\x01\x00\x00' * 3
+        runs = compress_tile_runs(data)
+        # 100 empty tiles, 3 tiles with index 5, 256 + 241 empty tiles
+        self.assertEqual(runs, b'\x00\x00\x63\x00\x05\x01\x02\x00'
+                               b'\x00\x00\xff\x00\x00\x00\xf0\x00')
+        self.assertEqual(expand_tile_runs(runs), data)
+        tiles = TileManager(runs=runs)
+        self.assertEqual(len(tiles), 600)
+        self.assertEqual(tiles[101], Tile(5, 1))
+        self.assertEqual(tiles[-1], Tile())
+        self.assertEqual(list(tiles.iter_runs()),
+                         [(0, 0, 100), (5, 1, 3), (0, 0, 256), (0, 0, 241)])
+        self.assertEqual(tiles.compressed(), runs)
+        self.assertEqual(list(tiles), list(TileManager(data=data)))
+        # still not expanded
+        self.assertIsNone(tiles._data)
+        tiles[0] = Tile(2)
+        self.assertEqual(tiles.data[4:], data[4:])
+        self.assertEqual(list(tiles.iter_runs())[:2], [(2, 0, 1), (0, 0, 99)])
 
 class TestQuadLayer(unittest.TestCase):
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from PIL import Image
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .constants import TILEFLAG_HFLIP, TILEFLAG_ROTATE, TILEFLAG_VFLIP
+from .items import Tile, TileLayer
+from .render import ArrayAtlas, TileAtlas, image_bands, prepare_tilelayers, \
+                    render_array, render_tilelayer, tile_grid
+from .tml import Teemap
+
+
+class TestRender(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('test_tmp')
+        self.teemap = Teemap('tml/test_maps/vanilla')
+
+    def tearDown(self):
+        if os.path.isdir('test_tmp'):
+            shutil.rmtree('test_tmp')
+
+    def test_atlas(self):
+        atlas = TileAtlas(self.teemap.images[0])
+        tile = atlas.tile(1, 0)
+        self.assertEqual(tile.size, (64, 64))
+        self.assertIs(atlas.tile(1, 0), tile)
+        self.assertIs(atlas.tile(1, 16), tile)
+        self.assertEqual(atlas.tile(1, 1).tobytes(),
+                         tile.transpose(Image.FLIP_LEFT_RIGHT).tobytes())
+        run = atlas.run(1, 0, 3)
+        self.assertEqual(run.size, (192, 64))
+        self.assertEqual(run.crop((128, 0, 192, 64)).tobytes(), tile.tobytes())
+        # only the tiles are cached
+        self.assertIsNot(atlas.run(1, 0, 3), run)
+        self.assertEqual(len(atlas._tiles), 2)
+        self.assertEqual(TileAtlas(self.teemap.images[0], 16).tile(1).size,
+                         (16, 16))
+
+    def test_tile_grid(self):
+        layer = TileLayer(4, 2)
+        layer.tiles[0] = Tile(5, skip=2)
+        layer.tiles[1] = Tile(6)
+        indices, flags = tile_grid(layer)
+        self.assertEqual(indices, bytes([5, 5, 5, 6, 0, 0, 0, 0]))
+        self.assertEqual(flags, bytes(8))
+
+    def test_render_tilelayer(self):
+        layer = TileLayer(3, 2)
+        layer.set_tile(1, 0, Tile(1))
+        layer.set_tile(2, 1, Tile(1))
+        atlas = TileAtlas(self.teemap.images[0])
+        canvas = Image.new('RGBA', (3 * 64, 2 * 64))
+        render_tilelayer(canvas, layer, atlas)
+        self.assertEqual(canvas.getbbox(), (64, 0, 192, 128))
+        self.assertEqual(canvas.crop((64, 0, 128, 64)).tobytes(),
+                         atlas.tile(1).tobytes())
+        self.assertIsNone(canvas.crop((0, 0, 64, 128)).getbbox())
+
+    def test_export_to_png(self):
+        self.teemap.export_to_png('test_tmp/vanilla.png')
+        image = Image.open('test_tmp/vanilla.png')
+        self.assertEqual(image.size, (50 * 64, 50 * 64))
+        self.assertRaises(ValueError, self.teemap.export_to_png,
+                          'test_tmp/vanilla.png', method='foo')
+
+    def test_export_to_png_bands(self):
+        self.teemap.export_to_png('test_tmp/vanilla.png', tile_size=16)
+        self.teemap.export_to_png('test_tmp/bands.png', tile_size=16,
+                                  band_rows=7)
+        image = Image.open('test_tmp/vanilla.png')
+        bands = Image.open('test_tmp/bands.png')
+        self.assertEqual(bands.size, (50 * 16, 50 * 16))
+        self.assertEqual(bands.convert('RGBA').tobytes(), image.tobytes())
+
+    def test_image_bands(self):
+        # runs of every length from 1 to 10 tiles
+        layer = TileLayer(10, 10)
+        for y in range(10):
+            layer.fill((0, y, y + 1, 1), Tile(1))
+        atlas = TileAtlas(self.teemap.images[0], 4)
+        sizes = []
+        for band in image_bands([(layer, atlas)], 10, 10, 4, band_rows=2):
+            self.assertEqual(band.size, (40, 8))
+            # images cached by the atlas
+            sizes.append(sum(len(cache) for cache in vars(atlas).values()
+                             if isinstance(cache, dict)))
+        self.assertEqual(sizes, [1] * 5)
+
+    def test_export_thumbnail(self):
+        self.teemap.export_thumbnail('test_tmp/vanilla.png')
+        self.assertEqual(Image.open('test_tmp/vanilla.png').size, (250, 250))
+        self.teemap.export_thumbnail('test_tmp/vanilla.png', 32)
+        self.assertEqual(Image.open('test_tmp/vanilla.png').size, (32, 32))
+        # one pixel per tile is the average colour of the tile
+        atlas = TileAtlas(self.teemap.images[0], 1)
+        tile = TileAtlas(self.teemap.images[0]).tile(1)
+        self.assertEqual(atlas.tile(1).getpixel((0, 0)),
+                         tile.resize((1, 1), Image.BOX).getpixel((0, 0)))
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_array_atlas(self):
+        atlas = TileAtlas(self.teemap.images[0])
+        array_atlas = ArrayAtlas(self.teemap.images[0])
+        for flags in range(16):
+            variant = array_atlas.variant(flags & 3 | (4 if flags & 8 else 0))
+            self.assertEqual(variant[1].tobytes(), atlas.tile(1, flags).tobytes())
+        self.assertTrue(array_atlas.transparent[256])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_render_array(self):
+        layer = TileLayer(3, 2)
+        layer.set_tile(1, 0, Tile(1, TILEFLAG_HFLIP | TILEFLAG_VFLIP))
+        layer.set_tile(2, 1, Tile(1, TILEFLAG_ROTATE))
+        layer.image_id = 0
+        atlas = TileAtlas(self.teemap.images[0])
+        canvas = Image.new('RGBA', (3 * 64, 2 * 64))
+        render_tilelayer(canvas, layer, atlas)
+        layers = prepare_tilelayers([layer], self.teemap.images)
+        array = render_array(layers, 3, 2, band_rows=1)
+        self.assertEqual(array.shape, (128, 192, 4))
+        self.assertEqual(array.tobytes(), canvas.tobytes())
+        self.teemap.export_to_png('test_tmp/vanilla.png', method='numpy')
+        image = Image.open('test_tmp/vanilla.png')
+        self.assertEqual(image.size, (50 * 64, 50 * 64))
+
+if __name__ == '__main__':
+    unittest.main()
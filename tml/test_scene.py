@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from PIL import Image
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .items import Group, Image as MapImage, Quad, QuadLayer, Tile, TileLayer
+from .tml import Teemap
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestScene(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('test_tmp')
+        self.teemap = Teemap()
+        self.teemap.groups.append(Group(layers=[TileLayer(game=1)]))
+
+    def tearDown(self):
+        if os.path.isdir('test_tmp'):
+            shutil.rmtree('test_tmp')
+
+    def add_tiles(self, positions, **kwargs):
+        """Adds a group with a 3x3 layer of grass tiles, which are plain
+        brown at 4 pixels per tile."""
+        if not self.teemap.images:
+            self.teemap.images.append(MapImage(b'grass_main', external=True))
+        color = kwargs.pop('color', (255, 255, 255, 255))
+        layer = TileLayer(3, 3, image_id=0, color=color)
+        for x, y in positions:
+            layer.set_tile(x, y, Tile(1))
+        self.teemap.groups.append(Group(layers=[layer], **kwargs))
+
+    def render(self):
+        self.teemap.export_scene('test_tmp/scene.png', tile_size=4,
+                                 band_rows=1, workers=1)
+        return Image.open('test_tmp/scene.png').convert('RGBA')
+
+    def test_tiles(self):
+        self.add_tiles([(1, 1)], color=(255, 128, 0, 255))
+        image = self.render()
+        self.assertEqual(image.getbbox(), (4, 4, 8, 8))
+        self.assertEqual(image.getpixel((4, 4)), (161, 110 * 128 // 255, 0, 255))
+        self.assertEqual(image.getpixel((7, 7)), (161, 110 * 128 // 255, 0, 255))
+
+    def test_tiles_offset(self):
+        # moved by half a tile up and left, across the edges of the bands
+        self.add_tiles([(0, 0), (1, 1)], offset_x=16, offset_y=16)
+        image = self.render()
+        self.assertEqual(image.getbbox(), (0, 0, 6, 6))
+        for pixel in ((0, 0), (1, 1), (2, 2), (3, 4), (5, 5)):
+            self.assertEqual(image.getpixel(pixel), (161, 110, 54, 255))
+        for pixel in ((2, 0), (0, 2), (3, 1), (6, 6)):
+            self.assertEqual(image.getpixel(pixel)[3], 0)
+
+    def test_tiles_clipping(self):
+        self.add_tiles([(x, y) for x in range(3) for y in range(3)],
+                       use_clipping=1, clip_x=16, clip_y=0, clip_w=32,
+                       clip_h=16)
+        image = self.render()
+        self.assertEqual(image.getbbox(), (2, 0, 6, 2))
+        self.assertEqual(image.getpixel((2, 0)), (161, 110, 54, 255))
+
+    def test_no_gamelayer(self):
+        self.assertRaises(ValueError, Teemap().export_scene,
+                          'test_tmp/scene.png')
+
+    def test_quads(self):
+        # red quad over the tiles 1 to 2, blue below it from 3
+        layer = QuadLayer()
+        layer.quads.append(Quad(points=[(32*1024, 0), (96*1024, 0),
+                                        (32*1024, 64*1024), (96*1024, 64*1024),
+                                        (0, 0)],
+                                colors=[(255, 0, 0, 255)] * 4))
+        layer.quads.append(Quad(points=[(96*1024, 0), (128*1024, 0),
+                                        (96*1024, 64*1024), (128*1024, 64*1024),
+                                        (0, 0)],
+                                colors=[(0, 0, 255, 128)] * 4))
+        self.teemap.groups.append(Group(layers=[layer]))
+        self.teemap.export_scene('test_tmp/scene.png', tile_size=4, workers=1)
+        image = Image.open('test_tmp/scene.png').convert('RGBA')
+        self.assertEqual(image.size, (50 * 4, 50 * 4))
+        self.assertEqual(image.getpixel((4, 0)), (255, 0, 0, 255))
+        self.assertEqual(image.getpixel((11, 7)), (255, 0, 0, 255))
+        self.assertEqual(image.getpixel((12, 0)), (0, 0, 255, 128))
+        self.assertEqual(image.crop((0, 8, 200, 200)).getbbox(), None)
+
+    def test_parallax(self):
+        layer = QuadLayer()
+        layer.quads.append(Quad(points=[(0, 0), (64*1024, 0), (0, 64*1024),
+                                        (64*1024, 64*1024), (0, 0)],
+                                colors=[(0, 255, 0, 255)] * 4))
+        # a group half as fast as the camera in the center of the map
+        self.teemap.groups.append(Group(parallax_x=50, parallax_y=50,
+                                        layers=[layer]))
+        self.teemap.export_scene('test_tmp/scene.png', tile_size=32, workers=2)
+        image = Image.open('test_tmp/scene.png')
+        self.assertEqual(image.getbbox(), (400, 400, 464, 464))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,7 @@ import unittest
 import warnings
 
 from .tml import Teemap, MapError
-from . import items
+from . import items, probe
 
 class TestTeemap(unittest.TestCase):
 
@@ -106,6 +106,25 @@ class TestTeemap(unittest.TestCase):
         self.assertTrue(filecmp.cmp('test_tmp/test.png',
                                     'tml/test_mapres/test.png'))
 
+    def test_extract_images(self):
+        paths = self.teemap.extract_images('test_tmp/images', workers=2)
+        self.assertEqual(paths, [os.path.join('test_tmp/images', 'test.png')])
+        self.assertTrue(filecmp.cmp(paths[0], 'tml/test_mapres/test.png'))
+        paths = self.teemap.extract_images('test_tmp/images', external=True)
+        self.assertEqual(sorted(os.listdir('test_tmp/images')),
+                         ['grass_main.png', 'test.png'])
+
+    def test_shared_image_data(self):
+        image = self.teemap.images[1]
+        self.assertTrue(image.shared)
+        other = Teemap('tml/test_maps/vanilla', use_mmap=True).images[1]
+        self.assertIs(other._shared, image._shared)
+        self.assertEqual(len(image.data), image.width * image.height * 4)
+        self.assertIs(other.data, image.data)
+        image.data = b'\0' * len(other.data)
+        self.assertFalse(image.shared)
+        self.assertTrue(other.shared)
+
     def test_tiles(self):
         layer = self.teemap.layers[2]
         tiles = layer.tiles
@@ -218,6 +237,118 @@ class TestTeemap(unittest.TestCase):
                                     'test_tmp/copy.map'))
         self.assertTrue(filecmp.cmp('tml/test_maps/vanilla.map',
                                     'test_tmp/copy2.map'))
+
+    def test_save_parallel(self):
+        self.teemap.save('test_tmp/serial.map')
+        self.teemap.save('test_tmp/parallel.map', workers=4)
+        self.assertTrue(filecmp.cmp('test_tmp/serial.map',
+                                    'test_tmp/parallel.map'))
+        self.teemap.save('test_tmp/best.map', workers=2, compression_level=9)
+        teemap = Teemap('test_tmp/best.map')
+        self.assertEqual(list(teemap.layers[2].tiles),
+                         list(self.teemap.layers[2].tiles))
+
+    def test_save_race_layers(self):
+        teemap = Teemap()
+        group = items.Group()
+        group.layers.append(items.TileLayer(10, 10, game=1))
+        group.layers.append(items.TileLayer(10, 10, game=2))
+        group.layers.append(items.TileLayer(10, 10, game=4))
+        teemap.groups.append(group)
+        teemap.telelayer.tele_tiles.data[2:4] = b'\x05\x1a'
+        teemap.speeduplayer.speedup_tiles.data[8:12] = b'\x09\x00\x03\x00'
+        teemap.save('test_tmp/race.map')
+        teemap = Teemap('test_tmp/race.map')
+        self.assertEqual(teemap.telelayer.tele_tiles[1].number, 5)
+        self.assertEqual(teemap.telelayer.tele_tiles[1].type, 26)
+        self.assertEqual(teemap.speeduplayer.speedup_tiles[2].force, 9)
+        self.assertEqual(teemap.speeduplayer.speedup_tiles[2].angle, 3)
+
+    def test_save_skip_runs(self):
+        self.teemap.save('test_tmp/runs.map', skip_runs=True)
+        teemap = Teemap('test_tmp/runs.map')
+        for layer, saved in zip(self.teemap.layers, teemap.layers):
+            if layer.type == 'tilelayer':
+                self.assertEqual(len(saved.tiles), layer.width * layer.height)
+                self.assertEqual(saved.tiles.data, layer.tiles.data)
+
+    def test_probe(self):
+        info = probe('tml/test_maps/vanilla')
+        self.assertEqual((info.width, info.height), (50, 50))
+        self.assertIsNone(info.info)
+        self.assertEqual(info.images,
+                         tuple(image.name for image in self.teemap.images))
+        self.assertEqual(info.groups, len(self.teemap.groups))
+        self.assertEqual(info.tile_layers + info.quad_layers,
+                         len(self.teemap.layers))
+        self.teemap.info = items.Info(author=b'me', license=b'GPL')
+        self.teemap.save('test_tmp/info.map')
+        info = probe('test_tmp/info.map').info
+        self.assertEqual((info.author, info.credits, info.license),
+                         (b'me', None, b'GPL'))
+
+    def test_lazy(self):
+        teemap = Teemap('tml/test_maps/vanilla', lazy=True)
+        layer = teemap.layers[2]
+        self.assertIsNotNone(layer.tiles._loader)
+        self.assertIsNotNone(teemap.layers[0].quads._loader)
+        self.assertTrue(teemap.images[1].shared)
+        for i, tile in enumerate(layer.tiles[:5]):
+            self.assertEqual(tile.index, i)
+        self.assertIsNone(layer.tiles._loader)
+        self.assertEqual(teemap.images[1].data, self.teemap.images[1].data)
+        self.assertEqual(list(teemap.layers[1].quads),
+                         list(self.teemap.layers[1].quads))
+        teemap.save('test_tmp/lazy.map')
+        self.teemap.save('test_tmp/eager.map')
+        self.assertTrue(filecmp.cmp('test_tmp/lazy.map', 'test_tmp/eager.map'))
+
+    def test_lazy_changed(self):
+        shutil.copy('tml/test_maps/vanilla.map', 'test_tmp/lazy.map')
+        teemap = Teemap('test_tmp/lazy', lazy=True)
+        Teemap('tml/maps/dm1').save('test_tmp/lazy')
+        self.assertRaises(IOError, len, teemap.layers[2].tiles)
+
+    def test_mmap(self):
+        for lazy in (False, True):
+            teemap = Teemap('tml/test_maps/vanilla', lazy=lazy, use_mmap=True)
+            self.assertEqual([envelope.name for envelope in teemap.envelopes],
+                             [envelope.name for envelope in self.teemap.envelopes])
+            self.assertEqual([group.name for group in teemap.groups],
+                             [group.name for group in self.teemap.groups])
+            self.assertEqual(list(teemap.layers[2].tiles),
+                             list(self.teemap.layers[2].tiles))
+            self.assertEqual(teemap.images[1].data, self.teemap.images[1].data)
+            teemap.save('test_tmp/mmap.map')
+            self.teemap.save('test_tmp/eager.map')
+            self.assertTrue(filecmp.cmp('test_tmp/mmap.map', 'test_tmp/eager.map'))
+
+    def test_close(self):
+        with Teemap('tml/test_maps/vanilla', lazy=True, use_mmap=True) as teemap:
+            datafile = teemap._datafile
+            mapping, buffer = datafile._mmap, datafile._buffer
+            self.assertIsNotNone(mapping)
+        self.assertIsNone(datafile._mmap)
+        self.assertTrue(mapping.closed)
+        self.assertRaises(ValueError, mapping.read, 4)
+        self.assertRaises(ValueError, bytes, buffer)
+        # the data is read from the file again
+        self.assertEqual(teemap.layers[2].tiles.data,
+                         self.teemap.layers[2].tiles.data)
+        with open('test_tmp/broken.map', 'wb') as f:
+            f.write(b'DATA' + bytes(100))
+        self.assertRaises(TypeError, Teemap, 'test_tmp/broken.map',
+                          use_mmap=True)
+
+    def test_parallel_load(self):
+        teemap = Teemap('tml/test_maps/vanilla', workers=4)
+        for layer, other in zip(teemap.layers, self.teemap.layers):
+            if layer.type == 'tilelayer':
+                self.assertEqual(layer.tiles.data, other.tiles.data)
+            else:
+                self.assertEqual(layer.quads.quads, other.quads.quads)
+        self.assertEqual(teemap.images[1].data, self.teemap.images[1].data)
+
     def test_validate(self):
         teemap = Teemap()
         self.assertRaises(MapError, teemap.validate)
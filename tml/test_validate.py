@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from .items import Group, Tile, TileLayer
+from .tml import Teemap
+from .validate import RuleSet, check, get_rules, is_valid
+
+
+class TestValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.teemap = Teemap()
+        self.game = TileLayer(10, 10, game=1)
+        self.front = TileLayer(10, 10, name='Front')
+        self.tele = TileLayer(10, 10, game=2)
+        self.teemap.groups.append(Group(layers=[self.game, self.front,
+                                                self.tele]))
+        self.game.set_tile(1, 0, Tile(1))
+        self.game.set_tile(2, 3, Tile(192))
+        self.game.set_tile(4, 5, Tile(33)) # begin
+
+    def test_check(self):
+        self.assertIs(self.teemap.frontlayer, self.front)
+        self.assertTrue(is_valid(self.teemap))
+        self.assertEqual(check(self.teemap, 'vanilla')['game'], [(4, 5, 33)])
+        self.front.set_tile(3, 0, Tile(1))
+        self.tele.tele_tiles.data[2:4] = b'\x05\x1b'
+        self.tele.tele_tiles.data[4:6] = b'\x05\x07'
+        self.assertEqual(dict(check(self.teemap)),
+                         {'game': [], 'front': [(3, 0, 1)],
+                          'tele': [(2, 0, 7)]})
+        self.assertFalse(is_valid(self.teemap))
+
+    def test_index(self):
+        self.game.set_tile(0, 9, Tile(5))
+        expected = check(self.teemap)['game']
+        self.game.build_index()
+        self.assertEqual(check(self.teemap)['game'], expected)
+        self.assertEqual(expected, [(0, 9, 5)])
+
+    def test_rules(self):
+        rules = RuleSet('solid', game=[(1, 2)])
+        self.assertEqual(check(self.teemap, rules)['game'][:2],
+                         [(0, 0, 0), (2, 0, 0)])
+        self.assertTrue(get_rules('ddrace').is_valid('game', 33))
+        self.assertFalse(get_rules('vanilla').is_valid('game', 33))
+        self.assertRaises(ValueError, get_rules, 'unknown')
+        self.assertRaises(ValueError, RuleSet, 'broken', switch=[1])
+
+    def test_check_race(self):
+        speedup = TileLayer(10, 10, game=4)
+        self.teemap.groups[0].layers.append(speedup)
+        speedup.speedup_tiles.data[8:12] = b'\x09\x00\x03\x00'
+        self.tele.tele_tiles.data[2:4] = b'\x05\x1a'   # tele-in 5
+        self.tele.tele_tiles.data[20:22] = b'\x05\x1b' # tele-out 5
+        self.tele.tele_tiles.data[40:42] = b'\x06\x0e' # weapon tele-in 6
+        self.tele.tele_tiles.data[60:62] = b'\x07\x1b' # tele-out 7
+        race = self.teemap.check_race()
+        self.assertEqual(race.begin, [(4, 5)])
+        self.assertEqual(race.end, [])
+        self.assertEqual(race.teles[26, 5], [(1, 0)])
+        self.assertEqual(race.speedups[9, 3], [(2, 0)])
+        self.assertEqual(race.unpaired_tele_ins(), {(14, 6): [(0, 2)]})
+        self.assertEqual(race.unpaired_tele_outs(), {7: [(0, 3)]})
+        self.assertEqual(race.errors(), ['No end line',
+                                         'No tele-in for tele 7 at [(0, 3)]',
+                                         'No tele-out for tele 6 at [(0, 2)]'])
+        self.front.set_tile(9, 9, Tile(34))
+        self.assertEqual(self.teemap.check_race().end, [(9, 9)])
+
+if __name__ == '__main__':
+    unittest.main()
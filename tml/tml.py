@@ -8,6 +8,9 @@
     :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
     :license: GNU GPL, see LICENSE for more details.
 """
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import os
 import sys
 
 from PIL import Image
@@ -15,7 +18,8 @@ from PIL import Image
 from .constants import *
 from .datafile import DataFileReader, DataFileWriter
 from .items import TileLayer
-from .utils import get_next_tile_coords, add_tile_image_to_final_png, get_image_from_mapres
+from .validate import RaceCheck
+from . import render, scene
 
 class MapError(BaseException):
     """Raised when your map is not a valid teeworlds map.
@@ -33,13 +37,23 @@ class Teemap(object):
     All information about the map can be accessed through this class.
 
     :param map_path: Path to the teeworlds mapfile.
+    :param lazy: Only read the map structure on load. Tiles, quads and
+                 embedded images are decompressed on first access.
+    :param use_mmap: Read the map through a memory mapping of the file.
+    :param workers: Number of threads decompressing the map data on load.
+    :param cache: :class:`DiskCache <tml.cache.DiskCache>` of decompressed
+                  map data, ``True`` for the default cache.
+    :param index: Build an index of the tiles of every tilelayer, see
+                  :meth:`TileLayer.build_index <tml.items.TileLayer.build_index>`.
     """
 
-    def __init__(self, map_path=None):
+    def __init__(self, map_path=None, lazy=False, use_mmap=False, workers=None,
+                 cache=None, index=False):
         self.name = b''
+        self._datafile = None
 
         if map_path:
-            self._load(map_path)
+            self._load(map_path, lazy, use_mmap, workers, cache, index)
         else:
             # default item types
             for type_ in ITEM_TYPES:
@@ -47,6 +61,26 @@ class Teemap(object):
                     setattr(self, ''.join([type_, 's']), [])
             self.info = None
 
+    def close(self):
+        """Releases the memory mapping and cache entry a lazy map reads its
+        data from. Data accessed later is read from the file again.
+
+        Also called when the map is used as context manager:
+
+        >>> with Teemap('maps/dm1', lazy=True, use_mmap=True) as teemap:
+        ...     teemap.gamelayer.tiles[0]
+
+        """
+        if self._datafile is not None:
+            self._datafile.close()
+            self._datafile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @property
     def layers(self):
         """Returns a list of all layers, collected from the groups."""
@@ -88,6 +122,19 @@ class Teemap(object):
             if layer.is_speeduplayer:
                 return layer
 
+    @property
+    def frontlayer(self):
+        """Returns the frontlayer, or the tilelayer called ``Front`` in the
+        game group of older maps. Only for race modification."""
+        for layer in self.layers:
+            if layer.is_frontlayer:
+                return layer
+        for group in self.groups:
+            if group.is_gamegroup:
+                for layer in group.layers:
+                    if layer.type == 'tilelayer' and layer.name == 'Front':
+                        return layer
+
     @property
     def width(self):
         return self.gamelayer.width
@@ -119,21 +166,113 @@ class Teemap(object):
 
         return True
 
-    def _load(self, map_path):
+    def check_race(self):
+        """Checks the start and finish lines and the teleporters of a race
+        map.
+
+        :returns: :class:`RaceCheck <tml.validate.RaceCheck>`, see its
+                  :meth:`errors <tml.validate.RaceCheck.errors>`
+
+        """
+        return RaceCheck(self)
+
+    def _load(self, map_path, lazy=False, use_mmap=False, workers=None,
+              cache=None, index=False):
         """Load a new teeworlds map from `map_path`.
 
         Should only be called by __init__.
         """
-        datafile = DataFileReader(map_path)
+        if cache is True:
+            from .cache import DiskCache
+            cache = DiskCache()
+        datafile = DataFileReader(map_path, lazy=lazy, use_mmap=use_mmap,
+                                  workers=workers, cache=cache)
+        if lazy:
+            self._datafile = datafile
         self.envelopes = datafile.envelopes
         self.envpoints = datafile.envpoints
         self.groups = datafile.groups
         self.images = datafile.images
         self.info = datafile.info
-
-    def save(self, map_path):
-        """Saves the current map to `map_path`."""
-        DataFileWriter(self, map_path)
+        if index:
+            for layer in self.layers:
+                if layer.type == 'tilelayer':
+                    layer.build_index()
+
+    def extract_images(self, directory, workers=None, external=False):
+        """Saves the embedded images of the map as png files to `directory`,
+        named after the images.
+
+        :param workers: Number of threads writing the images, with ``None``
+                        they are written one after another.
+        :param external: Also copy the external images which exist in the
+                         mapres directory.
+        :returns: List of the written paths
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        images = []
+        for image in self.images:
+            if image.external:
+                if not external or not os.path.exists(image.mapres_path):
+                    continue
+            elif not image.data:
+                continue
+            path = os.path.join(directory, image.name.decode('utf-8'))
+            images.append((image, os.extsep.join([path, 'png'])))
+
+        def save(item):
+            item[0].save(item[1])
+            return item[1]
+        if workers and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(save, images))
+        return [save(item) for item in images]
+
+    def copy(self):
+        """Returns a copy of the map.
+
+        The tile, quad and image data is shared with this map, every tile
+        and quad buffer is only copied when one of the maps modifies it.
+        """
+        teemap = Teemap()
+        teemap.name = self.name
+        teemap.info = copy.deepcopy(self.info)
+        teemap.envelopes = copy.deepcopy(self.envelopes)
+        teemap.envpoints = copy.deepcopy(self.envpoints)
+        teemap.images = [copy.copy(image) for image in self.images]
+        teemap.groups = []
+        for group in self.groups:
+            group = copy.copy(group)
+            layers = []
+            for layer in group.layers:
+                layer = copy.copy(layer)
+                if layer.type == 'tilelayer':
+                    layer.tiles = layer.tiles.copy()
+                    if layer.tele_tiles is not None:
+                        layer.tele_tiles = layer.tele_tiles.copy()
+                    if layer.speedup_tiles is not None:
+                        layer.speedup_tiles = layer.speedup_tiles.copy()
+                else:
+                    layer.quads = layer.quads.copy()
+                layers.append(layer)
+            group.layers = layers
+            teemap.groups.append(group)
+        return teemap
+
+    def save(self, map_path, workers=None, compression_level=-1,
+             skip_runs=False):
+        """Saves the current map to `map_path`.
+
+        :param workers: Number of threads compressing the data blobs.
+        :param compression_level: zlib compression level.
+        :param skip_runs: Save runs of identical tiles skip compressed, like
+                          newer map versions do. Older clients can't read
+                          these maps.
+        """
+        DataFileWriter(self, map_path, workers=workers,
+                       compression_level=compression_level,
+                       skip_runs=skip_runs)
 
     def _create_default(self):
         """Creates the default map.
@@ -156,77 +295,146 @@ class Teemap(object):
         game_layer = items.TileLayer(game=1)
         game_group.layers.append(game_layer)
 
-    def export_to_png(self, output_file_path, progress_bar=False):
-        """Create a png file based on the map."""
-
-        # For each group
+    def export_to_png(self, output_file_path, progress_bar=False, method='pil',
+                      tile_size=render.TILE_SIZE, band_rows=None):
+        """Create a png file based on the map.
+
+        Renders the tilelayers of the game group, see :mod:`tml.render`.
+        Layers without an image (except the gamelayer) and layers with a
+        missing external image are left out.
+
+        :param method: ``'pil'`` pastes the tiles one run after another,
+                       ``'numpy'`` renders and blends whole layers as arrays
+                       and needs NumPy. The progress bar is only shown for
+                       ``'pil'``.
+        :param tile_size: Size of the rendered tiles in pixels, smaller sizes
+                          are rendered from downscaled mapres.
+        :param band_rows: Render and write the image in bands of this many
+                          tile rows, so only one band is held in memory. No
+                          progress bar is shown then.
+        """
+        if band_rows is not None:
+            return self._stream_gamegroup(output_file_path, tile_size, method,
+                                          band_rows)
+        image = self._render_gamegroup(tile_size, method, progress_bar)
+        if image is not None:
+            # Save image
+            image.save(output_file_path)
+
+    def export_thumbnail(self, output_file_path, max_size=256, method='pil'):
+        """Create a png preview of the map which fits in `max_size` pixels.
+
+        The tiles are rendered at the largest size which fits, down to one
+        pixel per tile with the average colour of the tile, so the map is
+        never rendered larger than one pixel per tile before it is shrunk.
+        See :meth:`export_to_png` for `method`.
+        """
+        group = self._get_gamegroup()
+        if group is None:
+            return
+        width, height = self._group_size(group)
+        tile_size = max(1, min(max_size // width, max_size // height,
+                               render.TILE_SIZE))
+        image = self._render_gamegroup(tile_size, method)
+        if image.width > max_size or image.height > max_size:
+            image.thumbnail((max_size, max_size), Image.BOX)
+        image.save(output_file_path)
+
+    def export_scene(self, output_file_path, tile_size=render.TILE_SIZE,
+                     band_rows=16, workers=None, camera=None, entities=False):
+        """Create a png file of the whole scene of the map.
+
+        Renders every group in order with parallax, offsets and clipping,
+        the quadlayers and the colours of the tilelayers, see
+        :mod:`tml.scene`. The image covers the game layer and is rendered in
+        bands of `band_rows` tile rows on a pool of processes. Needs NumPy.
+
+        :param workers: Number of processes, defaults to the number of CPUs.
+        :param camera: ``(x, y)`` camera position in world units (32 per
+                       tile) the parallax is seen from, defaults to the
+                       center of the map.
+        :param entities: Also render the game layer.
+        """
+        layers, width, height = scene.prepare_scene(self, tile_size, camera,
+                                                    entities)
+        bands = scene.scene_bands(layers, width, height, tile_size, band_rows,
+                                  workers)
+        with open(output_file_path, 'wb') as f:
+            render.write_png(f, bands, width * tile_size, height * tile_size)
+
+    def _get_gamegroup(self):
         for group in self.groups:
             # Keep only the groups where there is a game layer
             if [l for l in group.layers if l.is_gamelayer]:
-                # Get map size
-                image_width = max([l.width for l in group.layers if isinstance(l, TileLayer)])
-                image_height = max([l.height for l in group.layers if isinstance(l, TileLayer)])
-                # Create a new empty image
-                layer_image = Image.new('RGBA', (image_width * 64, image_height * 64))
-
-                # For each group layer
-                tile_layers = [l for l in group.layers if isinstance(l, TileLayer)]
-                for layer_index, layer in enumerate(tile_layers):
-                    mapres = None
-                    if not layer.is_gamelayer:
-                        # If It's not a gamelayer, get the mapres
-                        mapres = self.images[layer.image_id]
-
-                    # Progress bar
-                    if progress_bar:
-                        sys.stdout.write("\nLayer {}/{}".format(layer_index + 1, len(tile_layers)))
-                        sys.stdout.write("\nTiles in this layer: {}\n".format(len(layer.tiles)))
-                        toolbar_width = 100
-                        sys.stdout.write("[%s]" % (" " * toolbar_width))
-                        sys.stdout.flush()
-                        sys.stdout.write("\b" * (toolbar_width+1)) # return to start of line, after '['
-
-                    # For each cell on the layer grid
- #                   import ipdb;ipdb.set_trace()
-                    coord_y = 0
-                    coord_x = 0
-#                    continue
-                    for tile_index, tile in enumerate(layer.tiles):
-                        empty_tile = False
-                        if not layer.is_gamelayer:
-                            # If it's not a game layer, we get the tile from the mapres
-                            tile_image = get_image_from_mapres(mapres, tile.coords, tile.flags)
-                        else:
-                            # If it's a game layer, we get the tile from the entities mapres
-                            tile_type = R_TILEINDEX.get(tile.index)
-                            if not tile_type:
-                                empty_tile = True
-                            else:
-                                tile_image = get_image_from_mapres(None, tile.coords, None, True)
-
-                        if not empty_tile:
-                            # Add the tile_image to the final png image
-                            add_tile_image_to_final_png(layer_image, tile_image, (coord_x, coord_y))
-                            if progress_bar and tile_index * toolbar_width / len(layer.tiles) % 1 == 0:
-                                sys.stdout.write("-")
-                                sys.stdout.flush()
-
-                        # Get the next tile coords
-                        coord_x, coord_y = get_next_tile_coords(layer, coord_x, coord_y)
-                        # Repeat the tile on the final png image if it's needed
-                        for x in range(tile.skip):
-                            if not empty_tile:
-                                # Add the tile_image to the final png image
-                                add_tile_image_to_final_png(layer_image, tile_image, (coord_x, coord_y))
-                                if progress_bar and tile_index * toolbar_width / len(layer.tiles) % 1 == 0:
-                                    sys.stdout.write("-")
-                                    sys.stdout.flush()
-
-                            # Get the next tile coords
-                            coord_x, coord_y = get_next_tile_coords(layer, coord_x, coord_y)
-
-                # Save image
-                layer_image.save(output_file_path)
+                return group
+
+    @staticmethod
+    def _group_size(group):
+        """Returns the size of the largest tilelayers of a group, in tiles."""
+        width = max([l.width for l in group.layers if isinstance(l, TileLayer)])
+        height = max([l.height for l in group.layers if isinstance(l, TileLayer)])
+        return width, height
+
+    def _stream_gamegroup(self, output_file_path, tile_size, method, band_rows):
+        if method not in ('pil', 'numpy'):
+            raise ValueError('Unknown method {0!r}'.format(method))
+        group = self._get_gamegroup()
+        if group is None:
+            return
+        width, height = self._group_size(group)
+        tile_layers = [l for l in group.layers if isinstance(l, TileLayer)]
+        if method == 'numpy':
+            layers = render.prepare_tilelayers(tile_layers, self.images, tile_size)
+            bands = render.array_bands(layers, width, height, tile_size, band_rows)
+        else:
+            layers = render.tilelayer_atlases(tile_layers, self.images,
+                                              tile_size=tile_size)
+            bands = render.image_bands(layers, width, height, tile_size, band_rows)
+        with open(output_file_path, 'wb') as f:
+            render.write_png(f, bands, width * tile_size, height * tile_size)
+
+    def _render_gamegroup(self, tile_size=render.TILE_SIZE, method='pil',
+                          progress_bar=False):
+        if method not in ('pil', 'numpy'):
+            raise ValueError('Unknown method {0!r}'.format(method))
+        group = self._get_gamegroup()
+        if group is None:
+            return None
+        # Get map size
+        image_width, image_height = self._group_size(group)
+        tile_layers = [l for l in group.layers if isinstance(l, TileLayer)]
+
+        if method == 'numpy':
+            layers = render.prepare_tilelayers(tile_layers, self.images, tile_size)
+            canvas = render.render_array(layers, image_width, image_height,
+                                         tile_size)
+            return Image.fromarray(canvas, 'RGBA')
+
+        # Create a new empty image
+        image = Image.new('RGBA', (image_width * tile_size, image_height * tile_size))
+
+        # For each group layer, every mapres is only decoded once
+        layers = render.tilelayer_atlases(tile_layers, self.images,
+                                          tile_size=tile_size)
+        for layer_index, (layer, atlas) in enumerate(layers):
+            # Progress bar
+            progress = None
+            if progress_bar:
+                sys.stdout.write("\nLayer {}/{}".format(layer_index + 1, len(layers)))
+                sys.stdout.write("\nTiles in this layer: {}\n".format(len(layer.tiles)))
+                toolbar_width = 100
+                sys.stdout.write("[%s]" % (" " * toolbar_width))
+                sys.stdout.flush()
+                sys.stdout.write("\b" * (toolbar_width+1)) # return to start of line, after '['
+                def progress(row, height=layer.height):
+                    sys.stdout.write("-" * ((row + 1) * toolbar_width // height -
+                                            row * toolbar_width // height))
+                    sys.stdout.flush()
+
+            render.render_tilelayer(image, layer, atlas,
+                                    game=layer.is_gamelayer,
+                                    progress=progress)
+        return image
 
     def __repr__(self):
         return '<Teemap ({0})>'.format(self.name or 'new')
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+    Checks the tiles of a map against the tiles a game mod knows.
+
+    The rules of a mod are compiled into a 256 byte table per layer kind,
+    marking every tile value as valid or invalid. A whole layer is checked
+    by translating its raw tile data through the table, without building a
+    :class:`Tile <tml.items.Tile>` for every tile:
+
+        >>> is_valid(Teemap('maps/dm1'), 'vanilla')
+        True
+
+    The game and front layers are checked by the tile index, the tele layer
+    by the type of the tele tiles and the speedup layer by the force of the
+    speedup tiles.
+
+    :class:`RaceCheck` looks for the start and finish lines and unpaired
+    teleporters of race maps.
+
+    :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+from collections import OrderedDict, defaultdict
+from struct import unpack_from
+
+LAYER_KINDS = ('game', 'front', 'tele', 'speedup')
+
+# entity tiles start after this index
+ENTITY_OFFSET = 191
+
+# race tiles of the game and front layer
+TILE_BEGIN = 33
+TILE_END = 34
+# tele tile types, every tele-in needs a tele-out with the same number
+TELE_IN = 26
+TELE_OUT = 27
+TELE_INS = (10, 14, 15, TELE_IN) # evil, weapon, hook and normal tele-in
+
+
+def _entities(*rules):
+    """Moves rules of entity numbers to the tile indices of the entities."""
+    moved = []
+    for rule in rules:
+        if isinstance(rule, tuple):
+            moved.append((rule[0] + ENTITY_OFFSET, rule[1] + ENTITY_OFFSET))
+        else:
+            moved.append(rule + ENTITY_OFFSET)
+    return moved
+
+
+class RuleSet(object):
+    """Valid tile values of a game mod.
+
+    Every rule is a valid value or a ``(first, last)`` range of valid values.
+    Kinds of layers without rules only allow air.
+
+    :param name: Name of the mod, :func:`register` it under this name.
+    :param rules: Rules by layer kind, see :data:`LAYER_KINDS`.
+    """
+
+    def __init__(self, name, **rules):
+        self.name = name
+        # 0 for valid values and 1 for invalid ones, by layer kind
+        self.tables = {}
+        for kind in LAYER_KINDS:
+            table = bytearray(b'\x01' * 256)
+            for rule in rules.pop(kind, (0,)):
+                first, last = rule if isinstance(rule, tuple) else (rule, rule)
+                table[first:last+1] = bytes(last - first + 1)
+            self.tables[kind] = bytes(table)
+        if rules:
+            raise ValueError('Unknown layer kind {0}'.format(
+                ', '.join(sorted(rules))))
+
+    def is_valid(self, kind, value):
+        """Checks a single tile value."""
+        return not self.tables[kind][value]
+
+    def invalid_tiles(self, layer, kind):
+        """Returns the invalid tiles of a tilelayer.
+
+        :param kind: Layer kind to check the layer as, see :data:`LAYER_KINDS`
+        :returns: List of ``(x, y, value)`` tuples, row by row
+
+        """
+        table = self.tables[kind]
+        if kind == 'tele':
+            tiles, offset = layer.tele_tiles, 1
+        elif kind == 'speedup':
+            tiles, offset = layer.speedup_tiles, 0
+        else:
+            tiles, offset = layer.tiles, 0
+        if tiles is None:
+            return []
+        if tiles.index is not None and not offset and not table[0]:
+            # only look at the values which occur
+            positions = []
+            for value, count in enumerate(tiles.index.counts):
+                if count and table[value]:
+                    positions.extend((position, value) for position
+                                     in tiles.index.positions(value) or ())
+            positions.sort()
+        else:
+            values = bytes(memoryview(tiles._buffer())[offset::tiles.tile_size])
+            invalid = values.translate(table)
+            positions = []
+            position = invalid.find(1)
+            while position != -1:
+                positions.append((position, values[position]))
+                position = invalid.find(1, position + 1)
+        return [(position % layer.width, position // layer.width, value)
+                for position, value in positions]
+
+
+RULES = {}
+
+
+def register(rules):
+    """Makes a :class:`RuleSet` available by its name."""
+    RULES[rules.name] = rules
+
+
+def get_rules(mod):
+    """Returns the :class:`RuleSet` of a mod, `mod` is its name or the rule
+    set itself.
+
+    :raises: ValueError
+
+    """
+    if isinstance(mod, RuleSet):
+        return mod
+    try:
+        return RULES[mod]
+    except KeyError:
+        raise ValueError('Unknown mod {0}'.format(mod))
+
+
+def check(teemap, mod='ddrace'):
+    """Checks the game, front, tele and speedup layer of a map.
+
+    :returns: Invalid tiles, see :meth:`RuleSet.invalid_tiles`, by the kind
+              of every layer the map has
+
+    """
+    rules = get_rules(mod)
+    layers = (('game', teemap.gamelayer), ('front', teemap.frontlayer),
+              ('tele', teemap.telelayer), ('speedup', teemap.speeduplayer))
+    return OrderedDict((kind, rules.invalid_tiles(layer, kind))
+                       for kind, layer in layers if layer is not None)
+
+
+def is_valid(teemap, mod='ddrace'):
+    """Returns whether all tiles of a map are valid, see :func:`check`."""
+    return not any(check(teemap, mod).values())
+
+
+register(RuleSet(
+    'vanilla',
+    # air, solid, death, nohook and the entities from spawn to rifle
+    game=[(0, 3)] + _entities((1, 11)),
+))
+
+register(RuleSet(
+    'ddrace',
+    game=[0, (1, 4), 6, 9, (11, 13), (16, 22), (32, 62), (64, 67), (71, 76),
+          (88, 91), (104, 107), (190, 191)] +
+         _entities((1, 27), (29, 34), (42, 47), 49),
+    front=[0, 2, (4, 6), 9, (11, 13), (16, 22), (32, 62), (64, 67), (71, 76),
+           (88, 91), (104, 107)] +
+          _entities((1, 27), (29, 34), (42, 47), 49),
+    # tele in, tele out and the checkpoint teleporters
+    tele=[0, 10, 14, 15, 26, 27, (29, 31), 63],
+    speedup=[(0, 255)],
+))
+
+
+def _nonzero(values):
+    """Yields the positions of the non-zero bytes."""
+    values = values.translate(bytes([0] + [1] * 255))
+    position = values.find(1)
+    while position != -1:
+        yield position
+        position = values.find(1, position + 1)
+
+
+class RaceCheck(object):
+    """Checks the race layers of a map, see :meth:`Teemap.check_race
+    <tml.tml.Teemap.check_race>`.
+
+    The tele and speedup tiles are indexed in one pass over each layer, the
+    start and finish lines are looked up with :meth:`TileLayer.find
+    <tml.items.TileLayer.find>`, which uses the tile index if there is one.
+
+    :ivar begin: ``(x, y)`` of the start line tiles
+    :ivar end: ``(x, y)`` of the finish line tiles
+    :ivar teles: ``(x, y)`` of the tele tiles by ``(type, number)``
+    :ivar speedups: ``(x, y)`` of the speedup tiles by ``(force, angle)``
+    """
+
+    def __init__(self, teemap):
+        self.begin = []
+        self.end = []
+        for layer in (teemap.gamelayer, teemap.frontlayer):
+            if layer is not None:
+                self.begin.extend(layer.find(TILE_BEGIN))
+                self.end.extend(layer.find(TILE_END))
+        self.teles = defaultdict(list)
+        layer = teemap.telelayer
+        if layer is not None and layer.tele_tiles is not None:
+            data = layer.tele_tiles._buffer()
+            for position in _nonzero(bytes(memoryview(data)[1::2])):
+                self.teles[data[position*2+1], data[position*2]].append(
+                    (position % layer.width, position // layer.width))
+        self.speedups = defaultdict(list)
+        layer = teemap.speeduplayer
+        if layer is not None and layer.speedup_tiles is not None:
+            data = layer.speedup_tiles._buffer()
+            for position in _nonzero(bytes(memoryview(data)[0::4])):
+                self.speedups[unpack_from('Bxh', data, position*4)].append(
+                    (position % layer.width, position // layer.width))
+
+    def _numbers(self, types):
+        numbers = set()
+        for type_, number in self.teles:
+            if type_ in types:
+                numbers.add(number)
+        return numbers
+
+    def unpaired_tele_ins(self):
+        """Returns the tele-ins without a tele-out of the same number.
+
+        :returns: ``(x, y)`` of the tiles by ``(type, number)``
+
+        """
+        outs = self._numbers((TELE_OUT,))
+        return dict((key, positions) for key, positions in self.teles.items()
+                    if key[0] in TELE_INS and key[1] not in outs)
+
+    def unpaired_tele_outs(self):
+        """Returns the tele-outs without a tele-in of the same number.
+
+        :returns: ``(x, y)`` of the tiles by number
+
+        """
+        ins = self._numbers(TELE_INS)
+        return dict((number, positions) for (type_, number), positions
+                    in self.teles.items()
+                    if type_ == TELE_OUT and number not in ins)
+
+    def errors(self):
+        """Returns a list of error messages, empty for a valid map."""
+        errors = []
+        if not self.begin:
+            errors.append('No begin line')
+        if not self.end:
+            errors.append('No end line')
+        for number, positions in sorted(self.unpaired_tele_outs().items()):
+            errors.append('No tele-in for tele {0} at {1}'.format(
+                number, positions))
+        for (type_, number), positions in sorted(
+                self.unpaired_tele_ins().items(), key=lambda item: item[0][1]):
+            errors.append('No tele-out for tele {0} at {1}'.format(
+                number, positions))
+        return errors